@@ -0,0 +1,71 @@
+"""
+Benchmark for parsing and rendering hostile STML pages.
+
+usage: python benchmarks/bench_adversarial.py [--sizes 25000,50000,100000] [--engines fast,peg]
+                                              [--max-nodes 200000] [--max-seconds 1]
+
+Renders every kind of adversarial page from corpus.py (malformed and pathological documents) at
+each of --sizes with each engine, and reports the time taken, how that time grew from the previous
+size (2.0 for linear growth when the sizes double) and whether the page rendered or how it failed.
+Then renders the largest size again under a RenderBudget with the given limits, to show that
+pages that would go over it are stopped, and how much time stopping them takes.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stmlparse  # noqa: E402
+from corpus import ADVERSARIAL, generate_adversarial  # noqa: E402
+
+PAGE_ROOT = '/browse'
+
+
+def render(document, engine, budget=None):
+    """Returns (seconds, outcome) for one render."""
+    start = time.perf_counter()
+    try:
+        for _ in stmlparse.iter_stml_html(PAGE_ROOT, document, engine, budget=budget):
+            pass
+        outcome = 'rendered'
+    except (stmlparse.ParseError, stmlparse.RenderBudgetExceeded, RecursionError) as e:
+        outcome = type(e).__name__
+    return time.perf_counter() - start, outcome
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='25000,50000,100000,200000', help='comma separated page sizes')
+    parser.add_argument('--engines', default='fast,peg')
+    parser.add_argument('--kinds', default=','.join(ADVERSARIAL))
+    parser.add_argument('--max-nodes', type=int, default=200_000)
+    parser.add_argument('--max-seconds', type=float, default=1.0)
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    engines = args.engines.split(',')
+    kinds = args.kinds.split(',')
+
+    print(f'{"kind":<18}{"engine":<8}{"size":>9}{"time":>12}{"growth":>8}  outcome')
+    for kind in kinds:
+        for engine in engines:
+            previous = None
+            for size in sizes:
+                seconds, outcome = render(generate_adversarial(kind, size), engine)
+                growth = f'{seconds / previous:.2f}' if previous else ''
+                previous = seconds
+                print(f'{kind:<18}{engine:<8}{size:>9}{seconds * 1000:>10.2f}ms{growth:>8}  {outcome}')
+
+    size = sizes[-1]
+    print(f'\nwith a budget of {args.max_nodes} nodes and {args.max_seconds}s, at {size} characters')
+    for kind in kinds:
+        for engine in engines:
+            budget = stmlparse.RenderBudget(max_nodes=args.max_nodes, max_seconds=args.max_seconds)
+            seconds, outcome = render(generate_adversarial(kind, size), engine, budget)
+            print(f'{kind:<18}{engine:<8}{size:>9}{seconds * 1000:>10.2f}ms{"":>8}  {outcome}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Micro-benchmark for the STML attribute-to-CSS compiler.
+
+usage: python benchmarks/bench_css.py [--nodes N] [--distinct N] [--baseline OLD_STMLPARSE]
+
+Times stml_css() per node with a cold memo cache (every node compiled from scratch) and with a warm
+one, on nodes that repeat a limited number of attribute combinations like real pages do.
+--baseline takes a stmlparse.py from an older revision, e.g.
+`git show REV:flask_app/stmlparse.py > /tmp/old_stmlparse.py`, and times its stml_attrib_css()
+on the same nodes for comparison.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app'))
+import stmlparse  # noqa: E402
+
+PAGE_ROOT = '/browse'
+ATTRIBUTES = {
+    'backgroundColor': ['#000000', '#ffffff', '#ff00ff'],
+    'textColor': ['#ffffff', '#00ff00'],
+    'width': ['100', '50%'],
+    'height': ['20', '100%'],
+    'borderColor': ['#333333'],
+    'borderThickness': ['1', '2'],
+    'margin': ['4', '8'],
+    'marginVertical': ['2'],
+    'padding': ['4', '10'],
+    'align': ['left', 'center', 'right'],
+    'textSize': ['12', '16', '24'],
+    'backgroundImage': ['bg.png', 'dreamsettler.zed/~someone/tile.png'],
+    'backgroundRepeat': ['xy', 'none'],
+    'fashion': ['bold', 'bold,italic', 'upper'],
+    'display': ['floe', 'buoyed'],
+    'x': ['10'],
+    'y': ['20'],
+    'font': ['edita', 'dream', 'noble'],
+    'orientation': ['horizontal', 'vertical'],
+    'shadowAlpha': ['50'],
+    'shadowColor': ['#000000'],
+    'shadowX': ['2'],
+}
+
+
+def make_nodes(count, distinct, seed=0):
+    rng = random.Random(seed)
+    combos = []
+    for _ in range(distinct):
+        keys = rng.sample(sorted(ATTRIBUTES), rng.randint(1, 6))
+        combos.append({k: rng.choice(ATTRIBUTES[k]) for k in keys})
+    nodes = []
+    for i in range(count):
+        node = stmlparse.STMLNode('block')
+        node.attributes = dict(rng.choice(combos))
+        # ids and links are unique per node but don't affect the CSS
+        node.attributes['id'] = f'node{i}'
+        nodes.append(node)
+    return nodes
+
+
+def per_node(fn, nodes, before=None):
+    if before:
+        before()
+    start = time.perf_counter()
+    for node in nodes:
+        fn(PAGE_ROOT, node)
+    return (time.perf_counter() - start) / len(nodes)
+
+
+def load_baseline(path):
+    spec = importlib.util.spec_from_file_location('stmlparse_baseline', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    # older revisions print every background image
+    module.print = lambda *args, **kwargs: None
+    return lambda page_root, node: '; '.join(module.stml_attrib_css(page_root, node))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=50000)
+    parser.add_argument('--distinct', type=int, default=200, help='distinct attribute combinations')
+    parser.add_argument('--baseline', help='stmlparse.py of an older revision to compare against')
+    args = parser.parse_args()
+
+    nodes = make_nodes(args.nodes, args.distinct)
+    results = []
+    if args.baseline:
+        results.append(('baseline stml_attrib_css', per_node(load_baseline(args.baseline), nodes)))
+    def uncached(page_root, node):
+        stmlparse._compile_css.cache_clear()
+        return stmlparse.stml_css(page_root, node)
+    results.append(('stml_css, uncached', per_node(uncached, nodes)))
+    results.append(('stml_css, cold cache', per_node(stmlparse.stml_css, nodes, stmlparse._compile_css.cache_clear)))
+    results.append(('stml_css, warm cache', per_node(stmlparse.stml_css, nodes)))
+
+    print(f'{args.nodes} nodes, {args.distinct} distinct attribute combinations')
+    for name, seconds in results:
+        print(f'{name:28} {seconds * 1e6:8.2f} us/node')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Deep nesting benchmark and check for the STML parser and renderer.
+
+usage: python benchmarks/bench_depth.py [--depths 100,500,10000,100000] [--baseline OLD_STMLPARSE]
+
+Renders pages made of N nested blocks and checks the output is complete. --baseline takes a
+stmlparse.py from an older revision, e.g. `git show REV:flask_app/stmlparse.py > /tmp/old_stmlparse.py`,
+and times it on the same pages; depths it can't handle are reported with the error they raise.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app'))
+import stmlparse  # noqa: E402
+
+PAGE_ROOT = '/browse'
+
+
+def make_page(depth):
+    return ('<!doctype stml>\n<stml><head><title>deep</></><body>'
+            + '<block padding=1>' * depth + '<text>bottom</>' + '</>' * depth
+            + '</></>\n')
+
+
+def check(html, depth):
+    assert html.count('<div style="padding: 1px">') == depth, 'missing opening tags'
+    assert html.count('</div>') == depth + 1, 'missing closing tags'
+    assert html.endswith('</body></html>'), 'page is truncated'
+
+
+def run(stml_to_html, depth):
+    document = make_page(depth)
+    start = time.perf_counter()
+    try:
+        html = stml_to_html(PAGE_ROOT, document)
+    except (RecursionError, MemoryError) as e:
+        return type(e).__name__
+    elapsed = time.perf_counter() - start
+    check(html, depth)
+    return f'{elapsed * 1000:9.1f} ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depths', default='100,500,10000,100000')
+    parser.add_argument('--baseline', help='stmlparse.py of an older revision to compare against')
+    args = parser.parse_args()
+
+    renderers = [('current', stmlparse.stml_to_html)]
+    if args.baseline:
+        spec = importlib.util.spec_from_file_location('stmlparse_baseline', args.baseline)
+        baseline = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(baseline)
+        renderers.insert(0, ('baseline', baseline.stml_to_html))
+
+    print(f'{"depth":>8} ' + ' '.join(f'{name:>14}' for name, _ in renderers))
+    for depth in (int(d) for d in args.depths.split(',')):
+        print(f'{depth:8} ' + ' '.join(f'{run(fn, depth):>14}' for _, fn in renderers), flush=True)
+
+
+if __name__ == '__main__':
+    main()
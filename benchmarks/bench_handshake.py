@@ -0,0 +1,121 @@
+"""
+SSH handshake benchmark for the SFTP server.
+
+usage: python benchmarks/bench_handshake.py [--handshakes 200] [--configs ed25519/curve25519-sha256@libssh.org,...]
+
+Runs the SFTP server in a child process with a host key of each configuration's type, offering only
+its key exchange, and has a paramiko client connect --handshakes times in a row, close each
+connection after the key exchange and host key check and reconnect, the way a script that connects
+per upload does. Reports handshakes/sec and the CPU time per handshake on the server and on the
+client. A configuration is KEY/KEX, KEY being one of rsa2048, rsa4096, ecdsa256 and ed25519.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+
+import paramiko
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+KEYS = {
+    'rsa2048': ('rsa-sha2-256', lambda: rsa.generate_private_key(65537, 2048)),
+    'rsa4096': ('rsa-sha2-256', lambda: rsa.generate_private_key(65537, 4096)),
+    'ecdsa256': ('ecdsa-sha2-nistp256', lambda: ec.generate_private_key(ec.SECP256R1())),
+    'ed25519': ('ssh-ed25519', ed25519.Ed25519PrivateKey.generate),
+}
+CONFIGS = (
+    'rsa2048/curve25519-sha256@libssh.org',
+    'rsa4096/curve25519-sha256@libssh.org',
+    'ecdsa256/curve25519-sha256@libssh.org',
+    'ed25519/curve25519-sha256@libssh.org',
+    'ed25519/ecdh-sha2-nistp256',
+    'ed25519/diffie-hellman-group14-sha256',
+    'ed25519/diffie-hellman-group16-sha512',
+)
+
+
+def write_key(path, key):
+    with open(path, 'wb') as file:
+        file.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.OpenSSH,
+                                     serialization.NoEncryption()))
+
+
+def serve(root, key_path, kex, port):
+    # clients hang up right after the handshake, which paramiko logs as an error
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    sys.path.insert(0, ROOT)
+    from sftp_server.sftp import SFTPServer
+    server = SFTPServer(root, key_path, get_user=lambda username, password: None, kex=[kex])
+    server.serve_forever('127.0.0.1', port)
+
+
+def handshake(port, key_type, kex):
+    transport = paramiko.Transport(('127.0.0.1', port))
+    options = transport.get_security_options()
+    options.key_types = [key_type]
+    options.kex = [kex]
+    transport.start_client(timeout=30)
+    assert transport.host_key_type == key_type
+    transport.close()
+
+
+def run(tmp, key_name, kex, handshakes):
+    """Returns (handshakes/sec, server cpu seconds per handshake, client cpu seconds per handshake)."""
+    key_type, generate = KEYS[key_name]
+    key_path = os.path.join(tmp, key_name)
+    if not os.path.exists(key_path):
+        write_key(key_path, generate())
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = multiprocessing.get_context('fork').Process(target=serve, args=(tmp, key_path, kex, port), daemon=True)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    server.start()
+    # wait for the server to be listening, and warm up
+    for attempt in range(50):
+        try:
+            handshake(port, key_type, kex)
+            break
+        except paramiko.SSHException:
+            if attempt == 49:
+                raise
+            time.sleep(0.1)
+    client_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(handshakes):
+        handshake(port, key_type, kex)
+    elapsed = time.perf_counter() - start
+    client_cpu = time.process_time() - client_start
+    server.terminate()
+    server.join()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # includes the child's startup and the warm-up handshake
+    server_cpu = (children.ru_utime + children.ru_stime) - (children_before.ru_utime + children_before.ru_stime)
+    return handshakes / elapsed, server_cpu / (handshakes + 1), client_cpu / handshakes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--handshakes', type=int, default=200)
+    parser.add_argument('--configs', default=','.join(CONFIGS), help='comma separated KEY/KEX configurations')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{"key":<10}{"kex":<40}{"handshakes/s":>14}{"server cpu":>12}{"client cpu":>12}')
+        for config in args.configs.split(','):
+            key_name, kex = config.split('/', 1)
+            rate, server_cpu, client_cpu = run(tmp, key_name, kex, args.handshakes)
+            print(f'{key_name:<10}{kex:<40}{rate:>14.1f}{server_cpu * 1000:>10.2f}ms{client_cpu * 1000:>10.2f}ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Directory listing benchmark for the SFTP server.
+
+usage: python benchmarks/bench_listing.py [--sizes 100,1000,10000,50000] [--repeat 3] [--no-client]
+
+Creates a temporary directory with each number of --sizes files and times sending its listing the
+way paramiko's SFTP server does, 16 entries per READDIR reply, for the old list_folder (os.listdir,
+an lstat per entry and the whole SFTPAttributes list up front) and the current one. Unless
+--no-client is given it also times `listdir_attr` from a paramiko client over a local connection,
+which includes the round trips and the SSH encryption.
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ReadAll(object):
+    def has_read_access(self, path, block_root=False):
+        return True
+
+    def has_write_access(self, path, block_root=False):
+        return False
+
+    def __str__(self):
+        return '<bench>'
+
+
+def old_listing(dirpath):
+    return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(dirpath, filename)), filename=filename)
+            for filename in os.listdir(dirpath)]
+
+
+def send(listing):
+    """Hands out `listing` like paramiko does for READDIR requests, returns how many entries were sent."""
+    handle = paramiko.SFTPHandle()
+    handle._set_files(listing)
+    sent = 0
+    while True:
+        batch = handle._get_next_files()
+        if not batch:
+            return sent
+        sent += len(batch)
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def start_server(tmp, root):
+    from sftp_server.sftp import SFTPServer
+    key_path = os.path.join(tmp, 'host_key')
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_path)
+    server = SFTPServer(root, key_path, get_user=lambda username, password: ReadAll(), limits=None)
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    threading.Thread(target=server.serve_forever, args=('127.0.0.1', port), daemon=True).start()
+    # wait for serve_forever to be listening
+    for attempt in range(50):
+        try:
+            transport = paramiko.Transport(('127.0.0.1', port))
+            break
+        except paramiko.SSHException:
+            if attempt == 49:
+                raise
+            time.sleep(0.1)
+    transport.connect(username='bench', password='bench')
+    return transport, paramiko.SFTPClient.from_transport(transport)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000,50000', help='comma separated numbers of files')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-client', action='store_true', help='skip the paramiko client round trip')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, ROOT)
+    from sftp_server.sftp import FolderListing, list_entries
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'pages')
+        os.makedirs(root)
+        client = None if args.no_client else start_server(tmp, root)
+
+        print(f'{"listing":<10}{"files":>8}{"total":>12}{"per file":>12}')
+        for size in (int(n) for n in args.sizes.split(',')):
+            dirpath = os.path.join(root, str(size))
+            os.makedirs(dirpath)
+            for i in range(size):
+                with open(os.path.join(dirpath, f'asset{i:06d}.png'), 'wb') as file:
+                    file.write(b'x' * (i % 4096))
+            variants = {
+                'old': lambda: send(old_listing(dirpath)),
+                'current': lambda: send(FolderListing(list_entries(dirpath))),
+            }
+            if client is not None:
+                variants['client'] = lambda: len(client[1].listdir_attr(str(size)))
+            for name, fn in variants.items():
+                elapsed, count = best_of(args.repeat, fn)
+                assert count == size, (name, count)
+                print(f'{name:<10}{size:>8}{elapsed * 1000:>10.1f}ms{elapsed / size * 1e6:>10.2f}us')
+        if client is not None:
+            client[0].close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Login throughput benchmark for the SFTP server's SQLiteAuth.
+
+usage: python benchmarks/bench_login.py [--users 200] [--threads 1,4,16] [--logins 4000] [--baseline OLD_SQLITE_AUTH]
+
+Creates a temporary database with --users users owning three pages each, then has --threads
+concurrent clients log in --logins times in total, picking users at random, and reports logins/sec
+and the 50th/99th percentile latency. Runs with the login cache, without it (ttl 0), and with the
+SQLiteAuth from --baseline, e.g. `git show REV:sftp_server/sqlite_auth.py > /tmp/old_sqlite_auth.py`.
+This measures authentication only, not the SSH handshake around it.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(data_dir, users):
+    os.environ.update(SFTP_ROOT=os.path.join(data_dir, 'pages'), DATA_DIR=data_dir, SECRET_KEY='bench',
+                      DISCORD_ALLOWED_ROLES='')
+    sys.path.insert(0, ROOT)
+    from flask_app import app, db
+    from flask_app.models import User, DSPage
+    credentials = []
+    with app.app_context():
+        db.create_all()
+        for i in range(users):
+            user = User(id=i + 1, username=f'user{i}', sftp_user=f'sftp{i}', sftp_pass=f'password{i:016d}')
+            db.session.add(user)
+            credentials.append((user.sftp_user, user.sftp_pass))
+            for page in range(3):
+                db.session.add(DSPage(user_id=i + 1, page_type=1, page_name=f'page{i}x{page}.zed'))
+        db.session.commit()
+    return app, db, credentials
+
+
+def load_baseline(path):
+    spec = importlib.util.spec_from_file_location('baseline_sqlite_auth', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.SQLiteAuth
+
+
+def run(auth, credentials, threads, logins):
+    """Returns (logins/sec, p50 seconds, p99 seconds)."""
+    per_thread = logins // threads
+    latencies = []
+    lock = threading.Lock()
+    start_gate = threading.Barrier(threads + 1)
+
+    def client(seed):
+        rng = random.Random(seed)
+        mine = []
+        start_gate.wait()
+        for _ in range(per_thread):
+            username, password = rng.choice(credentials)
+            start = time.perf_counter()
+            auth(username, password)
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=client, args=(seed,)) for seed in range(threads)]
+    for worker in workers:
+        worker.start()
+    start_gate.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--threads', default='1,4,16', help='comma separated numbers of concurrent clients')
+    parser.add_argument('--logins', type=int, default=4000)
+    parser.add_argument('--baseline', metavar='OLD_SQLITE_AUTH')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        app, db, credentials = setup(data_dir, args.users)
+        from flask_app.ownership import OwnershipStamps
+        from sftp_server.sqlite_auth import SQLiteAuth
+        stamps = OwnershipStamps(os.path.join(data_dir, 'ownership'))
+        variants = {
+            'cached': lambda: SQLiteAuth(app, db, stamps=stamps),
+            'uncached': lambda: SQLiteAuth(app, db, ttl=0),
+        }
+        if args.baseline:
+            baseline = load_baseline(args.baseline)
+            variants['baseline'] = lambda: baseline(app, db)
+
+        print(f'{"auth":<10}{"threads":>8}{"logins/s":>12}{"p50":>10}{"p99":>10}')
+        for name, make_auth in variants.items():
+            for threads in (int(n) for n in args.threads.split(',')):
+                # a fresh instance each time, so the cache starts out cold
+                rate, p50, p99 = run(make_auth(), credentials, threads, args.logins)
+                print(f'{name:<10}{threads:>8}{rate:>12.0f}{p50 * 1000:>8.3f}ms{p99 * 1000:>8.3f}ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
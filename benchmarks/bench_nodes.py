@@ -0,0 +1,84 @@
+"""
+Memory benchmark for the parsed STML tree.
+
+usage: python benchmarks/bench_nodes.py [--blocks N] [--baseline OLD_STMLPARSE]
+
+Parses a synthetic large page and reports how much memory the resulting tree retains, per node.
+--baseline takes a stmlparse.py from an older revision, e.g.
+`git show REV:flask_app/stmlparse.py > /tmp/old_stmlparse.py`, and measures its tree for comparison.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app'))
+import stmlparse  # noqa: E402
+
+
+def make_page(blocks):
+    parts = ['<!doctype stml>\n<sss><style id=title textColor=#ffffff textSize=24 /></>\n',
+             '<stml><head><title>Benchmark</></><body backgroundColor=#000000>\n']
+    for i in range(blocks):
+        parts.append(
+            f'<block orientation=vertical padding=4>\n'
+            f'  <text style=title>Block {i}</>\n'
+            f'  <text fashion=bold>Some text\nover two lines</>\n'
+            f'  <image source=img{i % 20}.png />\n'
+            f'  <rule />\n'
+            f'  <link to=page{i % 7}.stml>a link</>\n'
+            f'</>\n')
+    parts.append('</></>\n')
+    return ''.join(parts)
+
+
+def count_nodes(nodes):
+    count = 0
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(getattr(node, 'children', ()))
+    return count
+
+
+def measure(module, document):
+    parse = getattr(module, 'parse_stml', None)
+    if parse is None:
+        # revisions before the fast engine only have the grammar
+        def parse(document):
+            parser = module.STMLParser()
+            parser.visit(module.grammar.parse(document))
+            return parser.root_tags
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    root_tags = parse(document)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return count_nodes(root_tags), retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--blocks', type=int, default=5000)
+    parser.add_argument('--baseline', help='stmlparse.py of an older revision to compare against')
+    args = parser.parse_args()
+
+    document = make_page(args.blocks)
+    modules = []
+    if args.baseline:
+        spec = importlib.util.spec_from_file_location('stmlparse_baseline', args.baseline)
+        baseline = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(baseline)
+        modules.append(('baseline', baseline))
+    modules.append(('current', stmlparse))
+
+    print(f'page of {len(document) / 1e6:.2f} MB')
+    for name, module in modules:
+        nodes, retained = measure(module, document)
+        print(f'{name:10} {nodes} nodes, {retained / 1e6:7.2f} MB retained, {retained / nodes:6.1f} bytes/node')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Worker occupancy benchmark for page assets served through /browse.
+
+usage: python benchmarks/bench_offload.py [--sizes 1,16,128] [--client-mbps 50] [--modes direct,x-accel-redirect]
+
+Creates a temporary pages directory with files of each --sizes (in MiB) and requests them through the
+WSGI app with STATIC_OFFLOAD set to each of --modes, consuming the response body like a client on a
+--client-mbps link would. Reports how long the worker thread is tied up per request (until the
+response is closed) and the CPU time it spends, for full downloads and for a 1 MiB range request.
+With offloading, the proxy transfers the file and the worker is free as soon as the headers are out.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from werkzeug.test import EnvironBuilder
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+
+
+def make_app(pages_dir, data_dir, mode):
+    os.environ.update(SFTP_ROOT=pages_dir, DATA_DIR=data_dir, SECRET_KEY='bench',
+                      DISCORD_ALLOWED_ROLES='', STATIC_OFFLOAD='' if mode == 'direct' else mode)
+    # the app reads its configuration at import, so each mode gets a fresh import
+    for name in [name for name in sys.modules if name.startswith('flask_app')]:
+        del sys.modules[name]
+    sys.path.insert(0, ROOT)
+    # only the /browse blueprint, main.py would also need a database and an SFTP host key
+    from flask_app import app
+    from flask_app.stmlrender import bp
+    app.register_blueprint(bp)
+    app.config['LOGIN_DISABLED'] = True
+    return app
+
+
+def request(app, path, client_bps, headers=None):
+    """Returns (occupied seconds, cpu seconds, body bytes) for one request."""
+    environ = EnvironBuilder(path=path, headers=headers).get_environ()
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    body = 0
+    result = app(environ, lambda status, headers, exc_info=None: None)
+    try:
+        for chunk in result:
+            body += len(chunk)
+            # the worker can only write as fast as the client reads
+            if client_bps:
+                time.sleep(len(chunk) / client_bps)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return time.perf_counter() - start, time.process_time() - cpu_start, body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,16,128', help='comma separated file sizes in MiB')
+    parser.add_argument('--client-mbps', type=float, default=0,
+                        help='simulated client bandwidth in megabit/s, 0 to read as fast as possible')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(',')]
+    client_bps = args.client_mbps * 1e6 / 8
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pages_dir = os.path.join(tmp, 'pages')
+        data_dir = os.path.join(tmp, 'data')
+        os.makedirs(os.path.join(pages_dir, 'bench.zed'))
+        os.makedirs(data_dir)
+        block = os.urandom(1024 * 1024)
+        for size in sizes:
+            with open(os.path.join(pages_dir, 'bench.zed', f'{size}.bin'), 'wb') as file:
+                for _ in range(size):
+                    file.write(block)
+
+        print(f'{"mode":<18}{"size":>8}{"request":>10}{"occupied":>12}{"cpu":>10}{"body":>12}')
+        for mode in args.modes.split(','):
+            app = make_app(pages_dir, data_dir, mode)
+            for size in sizes:
+                path = f'/browse/bench.zed/{size}.bin'
+                for label, headers in (('full', None), ('range', {'Range': 'bytes=0-1048575'})):
+                    best = min(request(app, path, client_bps, headers) for _ in range(args.repeat))
+                    occupied, cpu, body = best
+                    print(f'{mode:<18}{size:>6}MB{label:>10}{occupied * 1000:>10.2f}ms{cpu * 1000:>8.2f}ms{body:>12}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Benchmark for the SFTP server's write permission checks.
+
+usage: python benchmarks/bench_permissions.py [--pages 1,10,100,1000,10000] [--checks 100000]
+                                              [--baseline OLD_PERMISSIONS_MANAGER]
+
+For a user owning each number of --pages, checks write access on a mix of paths at depths 1 to 6
+inside owned pages, inside pages they don't own and at page roots, and reports checks/sec and the
+time per check. --baseline takes a permissions_manager.py from an older revision, e.g.
+`git show REV:sftp_server/permissions_manager.py > /tmp/old_permissions_manager.py`, and runs the
+same checks through it.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_pages(count, rng):
+    pages = []
+    for i in range(count):
+        if i % 4 == 0:
+            pages.append(f'dreamsettler.zed/~user{i}')
+        else:
+            pages.append(f'page{i}.{rng.choice(("zed", "som", "nap"))}')
+    return pages
+
+
+def make_paths(pages, count, rng):
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        page = rng.choice(pages)
+        if kind < 0.1:
+            paths.append(page)
+        elif kind < 0.2:
+            # someone else's page, with a name that shares a prefix
+            paths.append(f'{page}x/main.stml')
+        else:
+            depth = rng.randint(0, 5)
+            paths.append('/'.join([page] + [f'dir{d}' for d in range(depth)] + ['main.stml']))
+    return paths
+
+
+def run(manager_module, pages, paths, repeat):
+    manager = manager_module.PermissionsManager(authenticate=lambda username, password: pages)
+    user = manager.get_user('bench', 'bench')
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            user.has_write_access(path, True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    allowed = sum(user.has_write_access(path, True) for path in paths)
+    return best, allowed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', default='1,10,100,1000,10000', help='comma separated numbers of owned pages')
+    parser.add_argument('--checks', type=int, default=100_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', metavar='OLD_PERMISSIONS_MANAGER')
+    args = parser.parse_args(argv)
+
+    # permissions_manager imports the database models, which read their configuration at import
+    data_dir = tempfile.mkdtemp()
+    os.environ.update(SFTP_ROOT=data_dir, DATA_DIR=data_dir, SECRET_KEY='bench', DISCORD_ALLOWED_ROLES='')
+    sys.path.insert(0, ROOT)
+    from sftp_server import permissions_manager
+    modules = {'current': permissions_manager}
+    if args.baseline:
+        modules['baseline'] = load(args.baseline, 'baseline_permissions_manager')
+
+    print(f'{"manager":<10}{"pages":>8}{"checks/s":>14}{"per check":>12}{"allowed":>10}')
+    for count in (int(n) for n in args.pages.split(',')):
+        rng = random.Random(count)
+        pages = make_pages(count, rng)
+        paths = make_paths(pages, args.checks, rng)
+        for name, module in modules.items():
+            elapsed, allowed = run(module, pages, paths, args.repeat)
+            print(f'{name:<10}{count:>8}{len(paths) / elapsed:>14.0f}{elapsed / len(paths) * 1e9:>10.0f}ns{allowed:>10}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
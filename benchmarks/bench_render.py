@@ -0,0 +1,135 @@
+"""
+Parser and renderer benchmark suite.
+
+usage: python benchmarks/bench_render.py [--engines fast,peg] [--json results.json] [--compare old.json]
+
+Runs every corpus configuration below (or only those picked with --configs) through each phase
+of stml_to_html separately:
+- parse: parse_stml, document to tree
+- visit: walking the tree and producing HTML fragments (iter_stml_tree)
+- emit: joining the fragments and encoding them as UTF-8
+- total: stml_to_html end to end
+and reports documents/sec and MB/sec (of STML source) for the best of --repeat runs, plus the peak
+memory allocated by each phase, measured in a separate untimed pass.
+--json writes the results in machine-readable form, --compare prints the speedup against such a file.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stmlparse  # noqa: E402
+from corpus import generate_page  # noqa: E402
+
+PAGE_ROOT = '/browse'
+
+# name -> generate_page parameters
+CONFIGS = {
+    'small': dict(size=10_000),
+    'medium': dict(size=100_000),
+    'large': dict(size=1_000_000),
+    'deep': dict(size=100_000, depth=200),
+    'attr-heavy': dict(size=100_000, attr_density=6),
+    'style-heavy': dict(size=100_000, styles=300),
+    'text-heavy': dict(size=100_000, text_ratio=0.9, attr_density=0.5),
+}
+PHASES = ('parse', 'visit', 'emit', 'total')
+
+
+def phase_functions(engine):
+    # each phase takes the output of the previous one, so phases can be timed on their own
+    return {
+        'parse': lambda document: stmlparse.parse_stml(document, engine),
+        'visit': lambda root_tags: list(stmlparse.iter_stml_tree(PAGE_ROOT, root_tags)),
+        'emit': lambda fragments: ''.join(fragments).encode('utf-8'),
+        'total': lambda document: stmlparse.stml_to_html(PAGE_ROOT, document, engine).encode('utf-8'),
+    }
+
+
+def run_phase(fn, inputs, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in inputs:
+            fn(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    peak = 0
+    for item in inputs:
+        tracemalloc.reset_peak()
+        fn(item)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return best, peak
+
+
+def bench_config(params, engine, docs, repeat):
+    documents = [generate_page(seed=seed, **params) for seed in range(docs)]
+    source_bytes = sum(len(document.encode('utf-8')) for document in documents)
+    fns = phase_functions(engine)
+    inputs = {'parse': documents, 'total': documents}
+    inputs['visit'] = [fns['parse'](document) for document in documents]
+    inputs['emit'] = [fns['visit'](root_tags) for root_tags in inputs['visit']]
+    results = {}
+    for phase in PHASES:
+        seconds, peak = run_phase(fns[phase], inputs[phase], repeat)
+        results[phase] = {
+            'seconds': seconds,
+            'docs_per_sec': docs / seconds,
+            'mb_per_sec': source_bytes / seconds / 1e6,
+            'peak_bytes': peak,
+        }
+    return {'params': params, 'docs': docs, 'source_bytes': source_bytes, 'phases': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--configs', default=','.join(CONFIGS), help='comma separated, from: ' + ', '.join(CONFIGS))
+    parser.add_argument('--engines', default=stmlparse.DEFAULT_ENGINE, help='comma separated, from: ' + ', '.join(stmlparse.ENGINES))
+    parser.add_argument('--docs', type=int, default=5, help='documents per configuration')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to compare against')
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    results = {}
+    print(f'{"config":12} {"engine":6} {"phase":6} {"docs/s":>9} {"MB/s":>8} {"peak MB":>8}')
+    for engine in args.engines.split(','):
+        for name in args.configs.split(','):
+            key = f'{name}/{engine}'
+            try:
+                results[key] = bench_config(CONFIGS[name], engine, args.docs, args.repeat)
+            except RecursionError:
+                print(f'{name:12} {engine:6} RecursionError')
+                continue
+            for phase, r in results[key]['phases'].items():
+                line = f'{name:12} {engine:6} {phase:6} {r["docs_per_sec"]:9.1f} {r["mb_per_sec"]:8.2f} {r["peak_bytes"] / 1e6:8.2f}'
+                old = previous.get(key, {}).get('phases', {}).get(phase)
+                if old:
+                    line += f'  {old["seconds"] / r["seconds"]:5.2f}x vs previous'
+                print(line, flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'renderer': stmlparse.RENDERER_VERSION,
+                'docs': args.docs,
+                'repeat': args.repeat,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
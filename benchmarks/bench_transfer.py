@@ -0,0 +1,161 @@
+"""
+Upload and download throughput benchmark for the SFTP server's file handles.
+
+usage: python benchmarks/bench_transfer.py [--size 64] [--chunk 32768] [--repeat 3] [--no-client]
+
+Writes and reads a --size MiB file in --chunk byte requests at explicit offsets, the way the SFTP
+server's handles see a pipelining client, through paramiko's stock SFTPHandle on a buffered file
+object (what the server used before) and SFTPFileHandle with pread/pwrite. Unless --no-client is given it also uploads and downloads the file with a
+paramiko client over a local connection, which includes the SSH encryption, with the stock handle
+and the current one.
+"""
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class AllowAll(object):
+    def has_read_access(self, path, block_root=False):
+        return True
+
+    def has_write_access(self, path, block_root=False):
+        return True
+
+    def __str__(self):
+        return '<bench>'
+
+
+def stock_handle(path, flags):
+    """The handle SFTPInterface.open returned before it used pread/pwrite."""
+    mode = 'rb' if flags == os.O_RDONLY else 'r+b'
+    fileobj = os.fdopen(os.open(path, flags, 0o664), mode)
+    handle = paramiko.SFTPHandle(flags)
+    handle.readfile = fileobj
+    if flags != os.O_RDONLY:
+        handle.writefile = fileobj
+    return handle
+
+
+def current_handle(path, flags):
+    from sftp_server.sftp import SFTPFileHandle
+    return SFTPFileHandle(flags, os.open(path, flags, 0o664))
+
+
+def upload(make_handle, path, size, chunk, block):
+    handle = make_handle(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    for offset in range(0, size, chunk):
+        assert handle.write(offset, block[:min(chunk, size - offset)]) == paramiko.SFTP_OK
+    handle.close()
+
+
+def download(make_handle, path, size, chunk):
+    handle = make_handle(path, os.O_RDONLY)
+    received = 0
+    for offset in range(0, size, chunk):
+        received += len(handle.read(offset, chunk))
+    handle.close()
+    assert received == size
+
+
+def best_of(repeat, fn, cleanup=None):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        # freeing the old file's pages as part of the next upload skews the results
+        if cleanup is not None:
+            cleanup()
+    return best
+
+
+def start_server(tmp, root):
+    from sftp_server.sftp import SFTPServer
+    key_path = os.path.join(tmp, 'host_key')
+    paramiko.RSAKey.generate(2048).write_private_key_file(key_path)
+    server = SFTPServer(root, key_path, get_user=lambda username, password: AllowAll(), limits=None)
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    threading.Thread(target=server.serve_forever, args=('127.0.0.1', port), daemon=True).start()
+    # wait for serve_forever to be listening
+    for attempt in range(50):
+        try:
+            transport = paramiko.Transport(('127.0.0.1', port))
+            break
+        except paramiko.SSHException:
+            if attempt == 49:
+                raise
+            time.sleep(0.1)
+    transport.connect(username='bench', password='bench')
+    return transport, paramiko.SFTPClient.from_transport(transport)
+
+
+def stock_interface():
+    """An SFTPInterface whose open returns stock handles."""
+    from sftp_server.sftp import SFTPInterface
+
+    class StockInterface(SFTPInterface):
+        def open(self, path, flags, attr):
+            realpath = self.realpath_for_read(path) if flags == os.O_RDONLY else self.realpath_for_write(path)
+            try:
+                return stock_handle(realpath, flags)
+            except OSError as e:
+                return paramiko.SFTPServer.convert_errno(e.errno)
+    return StockInterface
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=64, help='file size in MiB')
+    parser.add_argument('--chunk', type=int, default=32768, help='bytes per read or write request')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-client', action='store_true', help='skip the paramiko client round trip')
+    args = parser.parse_args(argv)
+    size = args.size * 1024 * 1024
+    block = os.urandom(args.chunk)
+
+    sys.path.insert(0, ROOT)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.bin')
+        handles = {
+            'stock': stock_handle,
+            'pread': current_handle,
+        }
+        print(f'{"handle":<16}{"upload":>12}{"download":>12}')
+        for name, make_handle in handles.items():
+            up = best_of(args.repeat, lambda: upload(make_handle, path, size, args.chunk, block),
+                         cleanup=lambda: os.unlink(path))
+            upload(make_handle, path, size, args.chunk, block)
+            down = best_of(args.repeat, lambda: download(make_handle, path, size, args.chunk))
+            print(f'{name:<16}{args.size / up:>10.0f}MB/s{args.size / down:>10.0f}MB/s')
+
+        if not args.no_client:
+            root = os.path.join(tmp, 'pages')
+            os.makedirs(root)
+            local = os.path.join(tmp, 'local.bin')
+            os.replace(path, local)
+            from sftp_server import sftp
+            for name, interface in (('client stock', stock_interface()), ('client current', sftp.SFTPInterface)):
+                # SFTPServer looks the interface up when a session starts
+                sftp.SFTPInterface = interface
+                transport, client = start_server(tmp, root)
+                up = best_of(args.repeat, lambda: client.put(local, 'bench.bin'))
+                down = best_of(args.repeat, lambda: client.get('bench.bin', os.path.join(tmp, 'got.bin')))
+                print(f'{name:<16}{args.size / up:>10.0f}MB/s{args.size / down:>10.0f}MB/s')
+                transport.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
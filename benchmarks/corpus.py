@@ -0,0 +1,132 @@
+"""
+Generator for synthetic STML pages, shared by the benchmarks.
+
+Pages are built from chains of nested containers holding text and leaf elements, and can be tuned with:
+- size: approximate length of the page in characters
+- depth: maximum nesting depth of containers inside <body>
+- attr_density: average number of attributes per element
+- styles: number of classes in the page's <sss> block (0 for none)
+- text_ratio: fraction of leaf children that are text rather than elements
+
+Running this file writes a page to stdout with the same parameters as command line flags.
+
+`generate_adversarial` builds malformed or pathological pages of a given size instead, the kind of
+upload a parser has to reject (or accept) without going super-linear. See ADVERSARIAL for the kinds.
+"""
+import argparse
+import random
+
+WORDS = ('dream settler page genie somnius zed nap som noble robot static signal tower '
+         'moon drift lantern orbit velvet echo harbor pixel').split()
+CONTAINERS = ('block', 'block', 'block', 'list')
+ATTRIBUTE_VALUES = {
+    'backgroundColor': ('#000000', '#ffffff', '#20204a', '#ff00ff'),
+    'textColor': ('#ffffff', '#00ff00', '#c0c0c0'),
+    'width': ('100', '320', '50%'),
+    'height': ('20', '240', '100%'),
+    'borderColor': ('#333333', '#ff0000'),
+    'borderThickness': ('1', '2'),
+    'margin': ('4', '8'),
+    'marginTop': ('2', '12'),
+    'marginHorizontal': ('6',),
+    'padding': ('4', '10'),
+    'align': ('left', 'center', 'right'),
+    'textSize': ('12', '16', '24'),
+    'backgroundImage': ('bg.png', 'tile.gif', 'dreamsettler.zed'),
+    'backgroundRepeat': ('xy', 'x', 'none'),
+    'fashion': ('bold', 'bold,italic', 'upper', 'line'),
+    'display': ('floe', 'buoyed'),
+    'x': ('10', '40'),
+    'y': ('20',),
+    'z': ('1', '5'),
+    'font': ('edita', 'dream', 'noble', 'loos'),
+    'orientation': ('horizontal', 'vertical'),
+    'shadowAlpha': ('50', '80'),
+    'shadowColor': ('#000000',),
+    'shadowBlur': ('4',),
+}
+ATTRIBUTE_NAMES = sorted(ATTRIBUTE_VALUES)
+
+
+def generate_page(size=100_000, depth=8, attr_density=2.0, styles=10, text_ratio=0.5, seed=0):
+    """Returns a synthetic STML page as a string. The same parameters always produce the same page."""
+    rng = random.Random(seed)
+
+    def attributes(extra=(), classes=True):
+        count = int(attr_density) + (rng.random() < attr_density % 1)
+        names = rng.sample(ATTRIBUTE_NAMES, min(count, len(ATTRIBUTE_NAMES)))
+        pairs = [f'{name}={rng.choice(ATTRIBUTE_VALUES[name])}' for name in names]
+        if classes and styles and rng.random() < 0.3:
+            pairs.append(f'style=s{rng.randrange(styles)}')
+        return ''.join(' ' + pair for pair in list(extra) + pairs)
+
+    def words(low, high):
+        return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(low, high)))
+
+    def leaf():
+        if rng.random() < text_ratio:
+            lines = [words(3, 12) for _ in range(rng.randint(1, 3))]
+            return f'<text{attributes()}>' + '\n'.join(lines) + '</>'
+        kind = rng.random()
+        if kind < 0.4:
+            return f'<image{attributes([f"source=img{rng.randrange(50)}.png"])} />'
+        if kind < 0.6:
+            return f'<rule{attributes()} />'
+        return f'<link{attributes([f"to=page{rng.randrange(20)}.stml"])}>{words(1, 4)}</>'
+
+    out = ['<!doctype stml>\n']
+    if styles:
+        out.append('<sss>\n')
+        out.extend(f'  <style id=s{i}{attributes(classes=False)} />\n' for i in range(styles))
+        out.append('</>\n')
+    out.append('<stml>\n<head><title>Synthetic page</></>\n<body>\n')
+    length = sum(map(len, out))
+    while length < size:
+        levels = rng.randint(1, depth)
+        chain = []
+        for level in range(levels):
+            indent = '  ' * level
+            chain.append(f'{indent}<{rng.choice(CONTAINERS)}{attributes()}>\n')
+            chain.extend(f'{indent}  {leaf()}\n' for _ in range(rng.randint(1, 3)))
+        chain.extend('  ' * level + '</>\n' for level in reversed(range(levels)))
+        out.extend(chain)
+        length += sum(map(len, chain))
+    out.append('</>\n</>\n')
+    return ''.join(out)
+
+
+ADVERSARIAL_HEAD = '<!doctype stml>\n<stml><head><title>Adversarial page</></><body>\n'
+# kind -> function of the approximate page size returning the page
+ADVERSARIAL = {
+    # tags that are never closed, nesting as deep as the page is long
+    'unclosed': lambda size: ADVERSARIAL_HEAD + '<block>' * (size // 7),
+    'unclosed-text': lambda size: ADVERSARIAL_HEAD + '<block>x' * (size // 8),
+    # one open tag with an endless attribute list, so every attribute has to be backtracked over
+    'attribute-flood': lambda size: ADVERSARIAL_HEAD + '<block ' + 'a=1 ' * (size // 4),
+    # text full of '<' that never start a tag
+    'lt-flood': lambda size: ADVERSARIAL_HEAD + '<text>' + '< ' * (size // 2) + '</></></>',
+    # text that runs to the end of the page without a close tag
+    'runaway-text': lambda size: ADVERSARIAL_HEAD + '<text>' + 'x' * size,
+    # well formed, just a lot of nodes
+    'node-flood': lambda size: ADVERSARIAL_HEAD + '<rule />' * (size // 8) + '</></>\n',
+}
+
+
+def generate_adversarial(kind, size=100_000):
+    return ADVERSARIAL[kind](size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100_000)
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--attr-density', type=float, default=2.0)
+    parser.add_argument('--styles', type=int, default=10)
+    parser.add_argument('--text-ratio', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(generate_page(args.size, args.depth, args.attr_density, args.styles, args.text_ratio, args.seed), end='')
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,10 @@ class Base(DeclarativeBase):
 SFTP_ROOT = os.environ.get('SFTP_ROOT')
 DATA_DIR = os.environ.get('DATA_DIR')
 DB_ABSPATH = os.path.join(DATA_DIR, 'db.sqlite')
+PRERENDER_DIR = os.path.join(DATA_DIR, 'prerender')
+SSS_DIR = os.path.join(DATA_DIR, 'sss')
+FAILURES_DIR = os.path.join(DATA_DIR, 'render-failures')
+OWNERSHIP_DIR = os.path.join(DATA_DIR, 'ownership')
 
 app = Flask(__name__, instance_path=DATA_DIR)
 app.wsgi_app = ProxyFix(app.wsgi_app)
@@ -34,6 +38,37 @@ app.config['OAUTH2_PROVIDERS'] = {
 app.config['DISCORD_API'] = 'https://discord.com/api{}'
 app.config['ALLOWED_GUILD'] = os.environ.get('DISCORD_ALLOWED_GUILD')
 app.config['ALLOWED_ROLES'] = os.environ.get('DISCORD_ALLOWED_ROLES').split(',')
+app.config['STML_CACHE_BYTES'] = int(os.environ.get('STML_CACHE_BYTES', 32 * 1024 * 1024))
+app.config['STML_PRERENDER'] = os.environ.get('STML_PRERENDER') == 'true'
+app.config['STML_CACHE_CONTROL'] = os.environ.get('STML_CACHE_CONTROL', 'private, no-cache')
+app.config['STML_MAX_SIZE'] = int(os.environ.get('STML_MAX_SIZE', 4 * 1024 * 1024))
+app.config['STML_MAX_NODES'] = int(os.environ.get('STML_MAX_NODES', 100000))
+app.config['STML_MAX_RENDER_SECONDS'] = float(os.environ.get('STML_MAX_RENDER_SECONDS', 2))
+app.config['STML_PRELOAD_LINKS'] = int(os.environ.get('STML_PRELOAD_LINKS', 8))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['STATIC_OFFLOAD'] = os.environ.get('STATIC_OFFLOAD', '')
+app.config['STATIC_OFFLOAD_PREFIX'] = os.environ.get('STATIC_OFFLOAD_PREFIX', '/_ds_pages/')
+app.config['SFTP_MAX_SESSIONS'] = int(os.environ.get('SFTP_MAX_SESSIONS', 64))
+app.config['SFTP_MAX_SESSIONS_PER_IP'] = int(os.environ.get('SFTP_MAX_SESSIONS_PER_IP', 8))
+app.config['SFTP_MAX_SESSIONS_PER_USER'] = int(os.environ.get('SFTP_MAX_SESSIONS_PER_USER', 4))
+app.config['SFTP_LOGIN_TIMEOUT'] = float(os.environ.get('SFTP_LOGIN_TIMEOUT', 30))
+app.config['SFTP_AUTH_CACHE_TTL'] = float(os.environ.get('SFTP_AUTH_CACHE_TTL', 300))
+app.config['SFTP_LISTING_MAX'] = int(os.environ.get('SFTP_LISTING_MAX', 0)) or None
+app.config['QUOTA_PAGE_BYTES'] = int(os.environ.get('QUOTA_PAGE_BYTES', 0)) or None
+app.config['QUOTA_PAGE_FILES'] = int(os.environ.get('QUOTA_PAGE_FILES', 0)) or None
+app.config['QUOTA_USER_BYTES'] = int(os.environ.get('QUOTA_USER_BYTES', 0)) or None
+app.config['QUOTA_USER_FILES'] = int(os.environ.get('QUOTA_USER_FILES', 0)) or None
+app.config['SFTP_AUDIT_LOG'] = os.environ.get('SFTP_AUDIT_LOG', '')
+app.config['SFTP_AUDIT_READ_SAMPLE'] = float(os.environ.get('SFTP_AUDIT_READ_SAMPLE', 1))
+app.config['SFTP_AUDIT_QUEUE'] = int(os.environ.get('SFTP_AUDIT_QUEUE', 10000))
+app.config['SFTP_HOST_KEYS'] = os.environ.get('SFTP_HOST_KEYS', 'host_key').split(',')
+app.config['SFTP_KEX'] = os.environ.get('SFTP_KEX', '').split(',') if os.environ.get('SFTP_KEX') else None
+app.config['SFTP_CIPHERS'] = os.environ.get('SFTP_CIPHERS', '').split(',') if os.environ.get('SFTP_CIPHERS') else None
+app.config['SFTP_MACS'] = os.environ.get('SFTP_MACS', '').split(',') if os.environ.get('SFTP_MACS') else None
+app.config['SFTP_METRICS_PORT'] = int(os.environ.get('SFTP_METRICS_PORT', 0))
+app.config['SFTP_METRICS_HOST'] = os.environ.get('SFTP_METRICS_HOST', '127.0.0.1')
+app.config['SFTP_SOCKET_BACKLOG'] = int(os.environ.get('SFTP_SOCKET_BACKLOG', 16))
 
 db = SQLAlchemy(app, model_class=Base)
 login = LoginManager(app)
@@ -0,0 +1,33 @@
+import gzip
+import mimetypes
+import zlib
+
+# Content-Encoding -> compressor, in order of preference. Only what the standard library provides.
+ENCODERS = {
+    'gzip': lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+    'deflate': lambda data, level: zlib.compress(data, level),
+}
+try:
+    from compression import zstd
+except ImportError:
+    pass
+else:
+    # Python 3.14+, zstd levels go higher than zlib's but the same numbers are reasonable
+    ENCODERS = {'zstd': lambda data, level: zstd.compress(data, level), **ENCODERS}
+
+# Anything else (images, archives, ...) is already compressed or not worth it
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+
+def negotiate(accept_encodings):
+    """Returns the best encoding in ENCODERS the client accepts, or None to send the content as is."""
+    return accept_encodings.best_match(ENCODERS)
+
+
+def compress(data, encoding, level):
+    return ENCODERS[encoding](data, level)
+
+
+def is_compressible(path):
+    mimetype = mimetypes.guess_type(path)[0]
+    return mimetype is not None and mimetype.startswith(COMPRESSIBLE_TYPES)
@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+from html import escape
+from urllib.parse import quote
+
+# Shown instead of a listing when a directory contains one of these, in order of preference
+MAIN_PAGES = ('main.stm', 'main.stml')
+
+
+class DirectoryListing:
+    """What the /browse handler needs to know about one directory, as of the directory's mtime."""
+
+    __slots__ = ('mtime_ns', 'main', 'html')
+
+    def __init__(self, mtime_ns, main, html):
+        self.mtime_ns = mtime_ns
+        # real path of the main page, or None to show the listing
+        self.main = main
+        self.html = html
+
+
+class DirectoryIndex:
+    """
+    Bounded LRU cache of scanned directories under `root`, keyed on their real path.
+
+    Adding, removing or renaming an entry updates the directory's mtime, so an entry is valid as long
+    as the mtime hasn't changed and a hit costs the stat the caller needed anyway.
+    """
+
+    def __init__(self, root, max_entries=4096):
+        self.root = os.path.realpath(root)
+        self._root_prefix = os.path.join(self.root, '')
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def contains(self, rpath):
+        """True if the real path `rpath` is the root or inside it."""
+        return rpath == self.root or rpath.startswith(self._root_prefix)
+
+    def resolve(self, path):
+        """Returns the real path of `path` relative to the root, or None if it points outside of it."""
+        rpath = os.path.realpath(os.path.join(self.root, path))
+        return rpath if self.contains(rpath) else None
+
+    def get(self, rpath, st):
+        """Returns the DirectoryListing for the directory `rpath`, `st` being its current stat."""
+        with self.lock:
+            listing = self.entries.get(rpath)
+            if listing is not None and listing.mtime_ns == st.st_mtime_ns:
+                self.entries.move_to_end(rpath)
+                return listing
+        # scanned outside the lock, two threads scanning the same directory just do the work twice
+        listing = self._scan(rpath, st)
+        with self.lock:
+            self.entries[rpath] = listing
+            self.entries.move_to_end(rpath)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return listing
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _scan(self, rpath, st):
+        names = {}
+        with os.scandir(rpath) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    # dangling symlink or vanished while scanning
+                    is_dir = False
+                names[entry.name] = (is_dir, entry.is_symlink())
+        main = None
+        for name in MAIN_PAGES:
+            if name in names and not names[name][0]:
+                main = os.path.join(rpath, name)
+                # a symlinked main page must not lead out of the root
+                if names[name][1]:
+                    main = os.path.realpath(main)
+                    if not self.contains(main):
+                        main = None
+                        continue
+                break
+        lines = []
+        # directories first, then case-insensitively by name
+        for name, (is_dir, _) in sorted(names.items(), key=lambda item: (not item[1][0], item[0].casefold(), item[0])):
+            # directories link with a trailing slash to save the redirect
+            suffix = '/' if is_dir else ''
+            lines.append(f'<li><a href="./{quote(name, errors='surrogateescape')}{suffix}">{escape(name)}{suffix}</a></li>\n')
+        return DirectoryListing(st.st_mtime_ns, main, ''.join(lines))
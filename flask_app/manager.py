@@ -1,8 +1,9 @@
 import flask
 from flask import Blueprint, render_template, flash
 from flask_login import login_required, current_user
-from flask_app import db, SFTP_ROOT, dlog
-from flask_app.models import DSPage
+from flask_app import app, db, SFTP_ROOT, OWNERSHIP_DIR, dlog
+from flask_app.models import DSPage, PageUsage
+from flask_app.ownership import OwnershipStamps
 from flask_app.stmlparse import re_pagename
 from sqlalchemy.exc import IntegrityError
 import re
@@ -10,6 +11,8 @@ import os
 
 re_username = re.compile(r'^[a-z][a-z0-9_]{2,64}$')
 bp = Blueprint('manager', __name__, template_folder='templates', url_prefix='/manager')
+# tells the SFTP server's login cache when a user's pages change
+ownership = OwnershipStamps(OWNERSHIP_DIR)
 
 @bp.route('/')
 @login_required
@@ -22,7 +25,11 @@ def pages():
     delete_pagetype = flask.request.args.get('delete_pagetype')
     delete_pagename = flask.request.args.get('delete_pagename')
     ds_pages = db.session.execute(db.select(DSPage).where(DSPage.user_id == current_user.id)).scalars().all()
-    return render_template('pages.html', ds_pages=ds_pages, delete_page=[delete_pagetype, delete_pagename])
+    uris = [page.get_uri() for page in ds_pages]
+    usage = {row.path: row for row in db.session.scalars(db.select(PageUsage).where(PageUsage.path.in_(uris)))}
+    total = (sum(row.bytes for row in usage.values()), sum(row.files for row in usage.values()))
+    return render_template('pages.html', ds_pages=ds_pages, delete_page=[delete_pagetype, delete_pagename],
+                           usage=usage, total=total)
 
 @bp.route('/delete', methods=['POST'])
 @login_required
@@ -39,6 +46,7 @@ def delete():
     if ds_page.user_id != current_user.id:
         return _flash_pages("No permissions to delete someone else's page.")
     db.session.delete(ds_page)
+    db.session.execute(db.delete(PageUsage).where(PageUsage.path == ds_page.get_uri()))
     try:
         os.rmdir(os.path.join(SFTP_ROOT, ds_page.get_uri()))
         flash("Page deleted.")
@@ -49,9 +57,18 @@ def delete():
     except FileNotFoundError:
         db.session.rollback()
         flash("Directory was found. This actually shouldn't happen, please report this.")
+    else:
+        _touch_ownership()
     finally:
         return pages()
 
+def _touch_ownership():
+    # the page change is done either way, a failed touch only means SFTP logins see it once their cache expires
+    try:
+        ownership.touch(current_user.id)
+    except OSError as e:
+        app.logger.warning(f'Could not update the ownership stamp of user {current_user.id}: {e}')
+
 def _flash_pages(msg):
     flash(msg)
     return pages()
@@ -94,6 +111,7 @@ def create():
         dlog(e)
         errors['general'] = 'This page already exists.'
         return render_template('create_page_form.html', errors=errors, pars=flask.request.values)
+    _touch_ownership()
     resp = flask.make_response(render_template('create_page_button.html'))
     resp.headers.set('HX-Refresh', 'true')
     return resp
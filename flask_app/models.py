@@ -22,4 +22,12 @@ class DSPage(db.Model):
             return f"dreamsettler.zed/~{self.page_name}"
         else:
             # page_type == 1 -> own TLD
-            return self.page_name
\ No newline at end of file
+            return self.page_name
+
+class PageUsage(db.Model):
+    """Bytes and files in a page directory, kept up to date by the SFTP server."""
+    __tablename__ = 'page_usage'
+    # DSPage.get_uri()
+    path = db.Column(db.String(64), primary_key=True)
+    bytes = db.Column(db.BigInteger(), nullable=False, default=0)
+    files = db.Column(db.BigInteger(), nullable=False, default=0)
@@ -0,0 +1,31 @@
+import os
+import time
+
+
+class OwnershipStamps:
+    """
+    Per-user change markers for page ownership, shared between the web app and the SFTP server.
+
+    The web app calls `touch` whenever it gives a user a page or takes one away. Whoever caches what
+    a user owns keeps the `get` value from when it looked it up, and looks it up again once it
+    differs. A marker is an empty file in `directory` named after the user id and its mtime is the
+    stamp, so checking costs a stat and works across processes and containers sharing DATA_DIR.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def touch(self, user_id):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, str(user_id))
+        # never stand still, even for two changes within the clock's resolution
+        stamp = max(time.time_ns(), self.get(user_id) + 1)
+        with open(path, 'a'):
+            pass
+        os.utime(path, ns=(stamp, stamp))
+
+    def get(self, user_id):
+        try:
+            return os.stat(os.path.join(self.directory, str(user_id))).st_mtime_ns
+        except FileNotFoundError:
+            return 0
@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict
+
+
+class CacheEntry:
+    __slots__ = ('identity', 'variants', 'assets')
+
+    def __init__(self, identity):
+        self.identity = identity
+        # encoding -> bytes
+        self.variants = {}
+        # URLs of the images the page references, see stmlparse.stml_assets
+        self.assets = ()
+
+
+class RenderCache:
+    """
+    Bounded LRU cache of rendered pages, keyed on the real path of the source file and the page root
+    it was rendered with. Each entry remembers the mtime and size of the file it was rendered from and
+    is dropped as soon as the file on disk no longer matches, so a cache hit costs a stat.
+
+    An entry holds one or more variants of the same content, by content encoding: 'identity' for the
+    HTML itself and e.g. 'gzip' for a compressed copy. Static files are cached the same way, with
+    None as page root and only their compressed variants.
+
+    Pages also keep the assets they reference, so they can be preloaded without rendering again.
+
+    `max_bytes` is the budget for all variants of all entries together, 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def identity(st):
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self, path, page_root, st):
+        """
+        Returns the CacheEntry, or None if the page isn't cached or the file has changed.
+        The entry must not be modified, use `put` to add variants.
+        """
+        key = (path, page_root)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.identity != self.identity(st):
+                self._drop(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, path, page_root, st, data, encoding='identity', assets=None):
+        """
+        Stores one variant of a page, and the assets it references if given.
+        Variants rendered from an older version of the file are dropped.
+        """
+        if len(data) > self.max_bytes:
+            return
+        key = (path, page_root)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.identity != self.identity(st):
+                self._drop(key)
+                entry = self.entries[key] = CacheEntry(self.identity(st))
+            old = entry.variants.get(encoding)
+            if old is not None:
+                self.size -= len(old)
+            entry.variants[encoding] = data
+            if assets is not None:
+                entry.assets = assets
+            self.size += len(data)
+            self.entries.move_to_end(key)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= sum(map(len, evicted.variants.values()))
+                self.evictions += 1
+
+    def tee(self, path, page_root, st, chunks, assets=None):
+        """
+        Encodes and passes through the chunks of a page that is being streamed, and stores the whole
+        page (and `assets`) once the last chunk has been sent. Pages that can't fit in the cache aren't collected.
+        """
+        parts = []
+        total = 0
+        for chunk in chunks:
+            data = chunk.encode()
+            if parts is not None:
+                total += len(data)
+                if total > self.max_bytes:
+                    parts = None
+                else:
+                    parts.append(data)
+            yield data
+        if parts is not None:
+            self.put(path, page_root, st, b''.join(parts), assets=assets)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= sum(map(len, entry.variants.values()))
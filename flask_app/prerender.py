@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from flask_app.stmlparse import iter_stml_tree, parse_stml, stml_assets, re_stml_file, RENDERER_VERSION
+
+
+class PrerenderStore:
+    """
+    Build directory holding rendered STML pages, mirroring the layout of `root`.
+
+    Each build file starts with a line of JSON describing what it was rendered from (the source's
+    mtime, size and sha256, the page root and the renderer version) and the assets the page
+    references, followed by the HTML.
+    Build files are replaced atomically, so readers see either the old or the new render.
+    """
+
+    def __init__(self, root, build_dir):
+        self.root = os.path.realpath(root)
+        self.build_dir = build_dir
+
+    def build_path(self, path):
+        rel = os.path.relpath(os.path.realpath(path), self.root)
+        if rel.startswith('..'):
+            return None
+        return os.path.join(self.build_dir, rel + '.html')
+
+    def load(self, path, page_root, st):
+        """
+        Returns the stored HTML for path as bytes and the assets it references if it was rendered from
+        the file as it is now, otherwise None.
+        """
+        build_path = self.build_path(path)
+        if build_path is None:
+            return None
+        try:
+            with open(build_path, 'rb') as f:
+                meta = json.loads(f.readline())
+                if (meta.get('mtime_ns'), meta.get('size')) != (st.st_mtime_ns, st.st_size) or \
+                        meta.get('page_root') != page_root or meta.get('renderer') != RENDERER_VERSION:
+                    return None
+                return f.read(), tuple(meta.get('assets', ()))
+        except (OSError, ValueError):
+            return None
+
+    def render(self, path, page_root, link_stylesheet=None, budget=None):
+        """
+        Renders path into the build directory. Unchanged content isn't rendered again, only restamped.
+        `link_stylesheet` and `budget` are passed on to the renderer.
+        """
+        build_path = self.build_path(path)
+        if build_path is None:
+            return
+        st = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        meta = {
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'page_root': page_root,
+            'renderer': RENDERER_VERSION,
+        }
+        html = self._reusable(build_path, meta)
+        if html is None:
+            try:
+                root_tags = parse_stml(data.decode('utf-8'), budget=budget)
+                meta['assets'] = stml_assets(page_root, root_tags)
+                html = ''.join(iter_stml_tree(page_root, root_tags, link_stylesheet, budget)).encode('utf-8')
+            except Exception:
+                # don't leave a render of an older version around
+                self.discard(path)
+                raise
+        os.makedirs(os.path.dirname(build_path), exist_ok=True)
+        tmp = f'{build_path}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(meta).encode('utf-8') + b'\n')
+            f.write(html)
+        os.replace(tmp, build_path)
+
+    def discard(self, path):
+        build_path = self.build_path(path)
+        if build_path is None:
+            return
+        try:
+            os.unlink(build_path)
+        except FileNotFoundError:
+            pass
+
+    def _reusable(self, build_path, meta):
+        try:
+            with open(build_path, 'rb') as f:
+                old = json.loads(f.readline())
+                if all(old.get(k) == meta[k] for k in ('sha256', 'page_root', 'renderer')) and 'assets' in old:
+                    meta['assets'] = old['assets']
+                    return f.read()
+        except (OSError, ValueError):
+            pass
+        return None
+
+
+class RenderFailures:
+    """
+    Why pages couldn't be rendered, as small JSON files in `directory`, so every worker knows a page
+    failed and stops serving 304s for it, whichever worker rendered it.
+    A failure only counts while the page's file has the mtime and size it was recorded for and the
+    renderer is the same version; stale ones are removed when they're looked up.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, path, page_root):
+        key = f'{path}\0{page_root}'.encode('utf-8', 'surrogateescape')
+        return os.path.join(self.directory, hashlib.sha256(key).hexdigest() + '.json')
+
+    def get(self, path, page_root, st):
+        """Returns why the page failed to render as it is now, or None."""
+        failure_path = self.path(path, page_root)
+        try:
+            with open(failure_path, 'rb') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (meta.get('mtime_ns'), meta.get('size')) != (st.st_mtime_ns, st.st_size) or \
+                meta.get('renderer') != RENDERER_VERSION:
+            try:
+                os.unlink(failure_path)
+            except FileNotFoundError:
+                pass
+            return None
+        return meta.get('reason')
+
+    def put(self, path, page_root, st, reason):
+        os.makedirs(self.directory, exist_ok=True)
+        failure_path = self.path(path, page_root)
+        meta = {'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'renderer': RENDERER_VERSION, 'reason': reason}
+        tmp = f'{failure_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, failure_path)
+
+
+class Prerenderer:
+    """
+    Renders uploaded STML pages into a PrerenderStore on a background thread.
+    `enqueue` can be passed as `on_write` to an SFTPServer; paths that aren't STML pages are ignored,
+    and a page that is written several times before the thread gets to it is only rendered once.
+    `make_budget` returns a new RenderBudget for each page, pages that go over it aren't prerendered.
+    """
+
+    def __init__(self, store, page_root, link_stylesheet=None, make_budget=None):
+        self.store = store
+        self.page_root = page_root
+        self.link_stylesheet = link_stylesheet
+        self.make_budget = make_budget
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def enqueue(self, path):
+        if not re_stml_file.search(path):
+            return
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending.add(path)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='prerender', daemon=True)
+                self.thread.start()
+        self.queue.put(path)
+
+    def run(self):
+        while True:
+            path = self.queue.get()
+            with self.lock:
+                self.pending.discard(path)
+            try:
+                budget = self.make_budget() if self.make_budget else None
+                self.store.render(path, self.page_root, self.link_stylesheet, budget)
+            except FileNotFoundError:
+                self.store.discard(path)
+            except Exception as e:
+                logging.info(('Prerender failed for %s: %s' % (path, e)).encode('utf-8'))
@@ -1,8 +1,17 @@
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import NodeVisitor
+from parsimonious.exceptions import ParseError, IncompleteParseError
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from types import MappingProxyType
 from urllib.parse import urlparse, urlunparse
+import argparse
+import functools
+import json
+import os
 import re
 import sys
+import time
 
 re_pagename = re.compile(r'^[a-z][a-z0-9-]{2,60}\.(zed|som|nap)$')
 
@@ -26,16 +35,112 @@ grammar = Grammar(r"""
 	_              = ws
 """)
 
+# Token patterns for the fast engine. These mirror the grammar above exactly. Parsimonious
+# uses the `regex` module, whose \s and case-insensitive [a-z] differ slightly from `re`, so
+# the character classes are spelled out instead of relying on flags.
+_WS = r'[^\S\x1c-\x1f]'
+re_ws = re.compile(f'{_WS}*')
+re_doctype = re.compile(r'<!doctype stml>', re.I)
+re_tagname = re.compile(r'[a-z]+')
+re_attribute = re.compile(r'([a-zA-Z]+)=([^ />]+)')
+re_text_end = re.compile(f'<{_WS}*[a-zA-Z/\u0130\u017f\u212a]')
+re_text_linebreak = re.compile(r'([^\s])\n')
+re_css_url = re.compile(r"url\('([^']*)'\)")
+
+DEFAULT_ENGINE = 'fast'
+# Bump whenever the HTML produced for the same document changes, so stored renders are discarded
+RENDERER_VERSION = 3
+
+class RenderBudgetExceeded(Exception):
+	"""Raised when parsing or rendering a page goes over its RenderBudget."""
+
+class RenderBudget:
+	"""
+	Limits on the work that parsing and rendering one page may do, so a hostile upload can't tie up
+	a worker: the document's length in characters, the number of nodes (tags and text) in its tree and
+	the CPU time spent by the thread. None disables a limit.
+	The CPU time is counted from when the budget is created, so use a new one for every render.
+	"""
+	# nodes between CPU time checks
+	CHECK_INTERVAL = 1024
+
+	def __init__(self, max_size=None, max_nodes=None, max_seconds=None):
+		self.max_size = max_size
+		self.max_nodes = max_nodes
+		self.max_seconds = max_seconds
+		self.deadline = time.thread_time() + max_seconds if max_seconds is not None else None
+
+	def check_size(self, size):
+		if self.max_size is not None and size > self.max_size:
+			raise RenderBudgetExceeded(f'the page is larger than the limit of {self.max_size}')
+
+	def check(self, nodes):
+		"""
+		Raises RenderBudgetExceeded if `nodes` nodes or the time spent so far are over budget.
+		Returns the node count at which to check again.
+		"""
+		if self.max_nodes is not None and nodes > self.max_nodes:
+			raise RenderBudgetExceeded(f'the page has more than {self.max_nodes} tags and texts')
+		if self.deadline is not None and time.thread_time() > self.deadline:
+			raise RenderBudgetExceeded(f'the page took more than {self.max_seconds} seconds to render')
+		if self.max_nodes is not None:
+			return min(nodes + self.CHECK_INTERVAL, self.max_nodes + 1)
+		return nodes + self.CHECK_INTERVAL
+
+# Shared by every node without children/attributes until they are first read through the properties
+_NO_CHILDREN = ()
+_NO_ATTRIBUTES = MappingProxyType({})
+
 class STMLNode:
-	"""Defines an STML node."""
+	"""
+	Defines an STML node.
+	`children` is a list and `attributes` a dict, like always. Most nodes have neither, so until one
+	is first read they share an empty tuple/mapping. The renderer reads the private slots, so it
+	doesn't give every leaf a list and dict of its own.
+	"""
+	__slots__ = ('self_closing', 'tag', '_children', '_attributes')
+
 	def __init__(self, tag=''):
 		self.self_closing = False
-		self.tag = tag
-		self.children = []
-		self.attributes = {}
+		self.tag = sys.intern(tag)
+		self._children = _NO_CHILDREN
+		self._attributes = _NO_ATTRIBUTES
+
+	@property
+	def children(self):
+		if self._children is _NO_CHILDREN:
+			self._children = []
+		return self._children
+
+	@children.setter
+	def children(self, children):
+		self._children = children
+
+	@property
+	def attributes(self):
+		if self._attributes is _NO_ATTRIBUTES:
+			self._attributes = {}
+		return self._attributes
+
+	@attributes.setter
+	def attributes(self, attributes):
+		self._attributes = attributes
+
+	def append_child(self, child):
+		if self._children is _NO_CHILDREN:
+			self._children = [child]
+		else:
+			self._children.append(child)
+
+	def set_attribute(self, name, value):
+		if self._attributes is _NO_ATTRIBUTES:
+			self._attributes = {}
+		self._attributes[sys.intern(name)] = value
 
 class TextNode:
 	"""Defines a non-STML text body that we actually want to keep. Page text that isn't a TextNode is discarded."""
+	__slots__ = ('text',)
+
 	def __init__(self, text):
 		self.text = text
 
@@ -84,7 +189,8 @@ class STMLParser(NodeVisitor):
 		html = STMLNode(tagname.text)
 		html.self_closing = self_closing
 		for (attribute, _) in attributes:
-			html.attributes.update(attribute)
+			for name, value in attribute.items():
+				html.set_attribute(name, value)
 		return html
 
 	def visit_tag_self(self, node, pars):
@@ -93,7 +199,7 @@ class STMLParser(NodeVisitor):
 	def visit_tag_body(self, node, children):
 		(tag_open, _, inner, _, _) = children
 		for child in inner:
-			tag_open.children.append(child[0])
+			tag_open.append_child(child[0])
 		return tag_open
 
 	def visit_ws(self, _1, _2):
@@ -106,38 +212,191 @@ class STMLParser(NodeVisitor):
 		return children or node
 
 
-def visit_stml_node(page_root, style, node):
-	if not isinstance(node, STMLNode):
-		if isinstance(node, TextNode):
-			# sub out line breaks for <br>, but only if preceded by an actual character
-			return re.sub(r'([^\s])\n', '\\1<br>\n', node.text)
-		return node or ''
-	tag = stml_rewrite_tag(node)
-	if not tag:
-		return ''
-	if tag == 'head':
-		node.children.append('<link rel="stylesheet" href="/static/ds.css">')
-		node.children.append('<link rel="preconnect" href="https://fonts.googleapis.com">')
-		node.children.append('<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>')
-		if style:
-			node.children.append(style)
-		node.children.append('<script>let FF_FOUC_FIX;</script>')
+def _skip_ws(document, pos):
+	return re_ws.match(document, pos).end()
+
+def _scan_tag(document, pos):
+	"""Matches tag_open or tag_self at pos. Returns (STMLNode, end) or None."""
+	if not document.startswith('<', pos):
+		return None
+	m = re_tagname.match(document, _skip_ws(document, pos + 1))
+	if not m:
+		return None
+	node = STMLNode(m.group())
+	pos = _skip_ws(document, m.end())
+	while m := re_attribute.match(document, pos):
+		node.set_attribute(m.group(1), m.group(2))
+		pos = _skip_ws(document, m.end())
+	if document.startswith('>', pos):
+		return node, pos + 1
+	if document.startswith('/>', pos):
+		node.self_closing = True
+		return node, pos + 2
+	return None
+
+def parse_stml_fast(document, budget=None):
+	"""
+	Single-pass scanner that builds the STML tree directly, without going through a parse tree.
+	Accepts exactly what `grammar` accepts; the only difference in the resulting tree is that the
+	empty TextNodes the grammar leaves in front of every close tag are omitted.
+	Runs in time linear in the length of the document, whatever the document.
+	"""
+	root_tags = []
+	stack = []
+	nodes = 0
+	next_check = budget.check(0) if budget is not None else float('inf')
+	m = re_doctype.match(document, _skip_ws(document, 0))
+	if not m:
+		raise ParseError(document, _skip_ws(document, 0), grammar['doctype'])
+	pos = _skip_ws(document, m.end())
+	size = len(document)
+	while pos < size:
+		tag = _scan_tag(document, pos)
+		if tag:
+			node, pos = tag
+			nodes += 1
+			if nodes >= next_check:
+				next_check = budget.check(nodes)
+			if stack:
+				stack[-1].append_child(node)
+			else:
+				root_tags.append(node)
+			if not node.self_closing:
+				stack.append(node)
+			pos = _skip_ws(document, pos)
+			continue
+		if not stack:
+			# only tags are allowed at the top level
+			break
+		m = re_text_end.search(document, pos)
+		if not m:
+			break
+		if m.start() > pos:
+			nodes += 1
+			if nodes >= next_check:
+				next_check = budget.check(nodes)
+			stack[-1].append_child(TextNode(document[pos:m.start()]))
+			pos = m.start()
+		elif document.startswith('</>', pos):
+			stack.pop()
+			pos = _skip_ws(document, pos + 3)
+		else:
+			break
+	# errors point at the same rules parsimonious would report
+	if stack:
+		raise ParseError(document, pos, grammar['tag_close'])
+	if not root_tags:
+		raise ParseError(document, pos, grammar['tag'])
+	if pos < size:
+		raise IncompleteParseError(document, pos, grammar['stml_page'])
+	return root_tags
+
+PEG_FRAMES_PER_TAG = 12
+
+def parse_stml_peg(document, budget=None):
+	"""
+	Parses an STML document with the parsimonious grammar.
+	Parsimonious can't be interrupted, so a budget's node and time limits are only checked once the
+	document has been parsed. Backtracking makes some malformed documents much slower to reject
+	than with the fast engine, only the size limit bounds that.
+	"""
+	# parsimonious and the visitor recurse about 10 frames per nesting level. Python calls don't use
+	# the C stack, so a higher limit only costs memory; every tag nests at most one level deeper
+	needed = document.count('<') * PEG_FRAMES_PER_TAG + 1000
+	if needed > sys.getrecursionlimit():
+		sys.setrecursionlimit(needed)
+	parser = STMLParser()
+	parser.grammar = grammar
+	parser.visit(grammar.parse(document))
+	if budget is not None:
+		nodes = 0
+		stack = list(parser.root_tags)
+		while stack:
+			node = stack.pop()
+			nodes += 1
+			stack.extend(getattr(node, '_children', ()))
+		budget.check(nodes)
+	return parser.root_tags
+
+ENGINES = {
+	'peg': parse_stml_peg,
+	'fast': parse_stml_fast,
+}
+
+def parse_stml(document, engine=DEFAULT_ENGINE, budget=None):
+	"""
+	Returns the root tags of an STML document, parsed with the selected engine.
+	With a RenderBudget, raises RenderBudgetExceeded if the document is over it.
+	"""
+	try:
+		parse = ENGINES[engine]
+	except KeyError:
+		raise ValueError(f'unknown STML engine: {engine}') from None
+	if budget is not None:
+		budget.check_size(len(document))
+	return parse(document, budget)
+
+def iter_stml_node(page_root, style, node, budget=None):
+	"""
+	Yields the HTML for an STML node and all of its children in document order.
+	Walks the tree with an explicit stack, so nesting depth is only limited by memory.
+	"""
+	# the stack holds nodes that still have to be rendered and closing tags that still have to be emitted
+	stack = [node]
+	nodes = 0
+	next_check = budget.check(0) if budget is not None else float('inf')
+	while stack:
+		node = stack.pop()
+		if isinstance(node, str):
+			yield node
+			continue
+		nodes += 1
+		if nodes >= next_check:
+			next_check = budget.check(nodes)
+		if not isinstance(node, STMLNode):
+			if isinstance(node, TextNode):
+				# sub out line breaks for <br>, but only if preceded by an actual character
+				yield re_text_linebreak.sub('\\1<br>\n', node.text)
+			continue
+		tag = stml_rewrite_tag(node)
+		if not tag:
+			continue
+		html, href = _stml_open_tag(page_root, tag, node)
+		if node.self_closing:
+			# html can't put hrefs on linked images, wrap in <a>
+			if href and tag == 'img':
+				yield f'<a href="{href}">{html}</a>'
+			else:
+				yield html
+			continue
+		yield html
+		# pushed in reverse: children, then head extras, then the closing tag
+		if tag == 'body':
+			stack.append(f'</div>\n</{tag}>')
+		else:
+			stack.append(f'</{tag}>')
+		if tag == 'head':
+			stack.extend(reversed(list(stml_head_extras(style))))
+		stack.extend(reversed(node._children))
+
+def _stml_open_tag(page_root, tag, node):
+	"""Returns the HTML opening tag for a node, and its rewritten link target if it has one."""
 	attribs = {}
-	css = stml_attrib_css(page_root, node)
+	css = stml_css(page_root, node)
 	if css:
-		attribs['style'] = '; '.join(css)
-	src = node.attributes.get('source')
+		attribs['style'] = css
+	src = node._attributes.get('source')
 	if src:
 		attribs['src'] = _rewrite_ds_url(src, page_root)
-	href = node.attributes.get('to')
+	href = node._attributes.get('to')
 	if href:
 		href = _rewrite_ds_url(href, page_root)
 		if not tag == 'img':
 			attribs['href'] = href
-	if 'id' in node.attributes:
-		attribs['id'] = node.attributes.get('id')
-	if 'style' in node.attributes:
-		attribs['class'] = node.attributes.get('style')
+	if 'id' in node._attributes:
+		attribs['id'] = node._attributes.get('id')
+	if 'style' in node._attributes:
+		attribs['class'] = node._attributes.get('style')
 	attrib_text = ' '.join([f'{k}="{v}"' for k, v in attribs.items()])
 	if attrib_text:
 		attrib_text = ' ' + attrib_text
@@ -145,26 +404,32 @@ def visit_stml_node(page_root, style, node):
 	if tag == 'body':
 		# contain the whole stml body in a div root
 		html += '<div id="stml_parser_root">\n'
-	if node.self_closing:
-		# html can't put hrefs on linked images, wrap in <a>
-		if href and tag == 'img':
-			return f'<a href="{href}">{html}</a>'
-		return html
-	for child in node.children:
-		html += visit_stml_node(page_root, style, child)
-	if tag == 'body':
-		html += '</div>\n'
-	html += f'</{tag}>'
-	return html
+	return html, href
+
+def visit_stml_node(page_root, style, node):
+	return ''.join(iter_stml_node(page_root, style, node))
+
+def stml_head_extras(style):
+	"""Tags appended to the end of the page's <head>."""
+	yield '<link rel="stylesheet" href="/static/ds.css">'
+	yield '<link rel="preconnect" href="https://fonts.googleapis.com">'
+	yield '<link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>'
+	if style:
+		yield style
+	yield '<script>let FF_FOUC_FIX;</script>'
 
 def visit_sss_node(page_root, node: STMLNode):
+	return '<style type="text/css">\n' + stml_sss_css(page_root, node) + '</style>'
+
+def stml_sss_css(page_root, node: STMLNode):
+	"""Returns the stylesheet for an sss node, one CSS class per style."""
 	classes = {}
-	for style in node.children:
+	for style in node._children:
 		if not isinstance(style, STMLNode):
 			continue
-		class_body = '; '.join(stml_attrib_css(page_root, style))
-		classes[style.attributes['id']] = class_body
-	return '<style type="text/css">\n' + '\n'.join([f'.{k} {{ {v} }}' for k, v in classes.items()]) + '</style>'
+		class_body = stml_css(page_root, style)
+		classes[style._attributes['id']] = class_body
+	return '\n'.join([f'.{k} {{ {v} }}' for k, v in classes.items()])
 
 def stml_rewrite_tag(node: STMLNode):
 	return {
@@ -198,142 +463,135 @@ def stml_rewrite_font(font: str):
 		'mystica': "'Jacquard 12', serif",
 	}.get(font, "Arial, Helvetica, sans-serif")
 
-def stml_attrib_css(page_root, node: STMLNode):
-	class_attributes = {}
-	shadow = STMLStyleShadow()  # prepare a shadow in case we come across shadow attributes
-	def _a(key, value, specificness=0):
-		# lower specificness = attribute will overwrite, 0 is most specific
-		if key in class_attributes:
-			current = class_attributes.get(key)
-			if specificness > current[1]:
-				# we already have a more specific attribute, ignore this update
-				return
-		class_attributes.update({key: [value, specificness]})
-	for k, v in node.attributes.items():
-		if k == 'backgroundColor':
-			_a('background-color', v)
-		elif k == 'textColor':
-			_a('color', v)
-		elif k == 'width':
-			try:
-				v = int(v)
-				_a('width', f'{v}px')
-			except ValueError:
-				_a('width', v)
-		elif k == 'height':
-			try:
-				v = int(v)
-				_a('height', f'{v}px')
-			except ValueError:
-				_a('height', v)
-		elif k == 'borderColor':
-			_a('border-color', v)
-			_a('border-style', 'solid')
-		elif k == 'borderThickness':
-			_a('border-width', f'{v}px')
-			_a('border-style', 'solid')
-		elif k == 'marginTop':
-			_a('margin-top', f'{v}px')
-		elif k == 'marginBottom':
-			_a('margin-bottom', f'{v}px')
-		elif k == 'marginLeft':
-			_a('margin-left', f'{v}px')
-		elif k == 'marginRight':
-			_a('margin-right', f'{v}px')
-		elif k == 'margin':
-			_a('margin', f'{v}px', 2)
-		elif k == 'marginVertical':
-			_a('margin-top', f'{v}px', 1)
-			_a('margin-bottom', f'{v}px', 1)
-		elif k == 'marginHorizontal':
-			_a('margin-left', f'{v}px', 1)
-			_a('margin-right', f'{v}px', 1)
-		elif k == 'padding':
-			_a('padding', f'{v}px')
-		elif k == 'align':
-			_a('text-align', v)
-			if v == 'left':
-				_a('align-self', 'start')
-			elif v == 'right':
-				_a('align-self', 'end')
-			else:
-				# not always correct
-				_a('align-self', v)
-		elif k == 'textSize':
-			_a('font-size', f'{v}px')
-		elif k == 'backgroundImage':
-			print(v)
-			_a('background-image', f'url(\'{_rewrite_ds_url(v, page_root)}\')')
-		elif k == 'backgroundRepeat':
-			bg_repeat = None
-			if v == 'x':
-				bg_repeat = 'repeat-x'
-			elif v == 'y':
-				bg_repeat = 'repeat-y'
-			elif v == 'none':
-				bg_repeat = 'no-repeat'
-			elif v == 'xy':
-				bg_repeat = 'repeat'
-			# TODO slice
-			if bg_repeat:
-				_a('background-repeat', bg_repeat)
-		elif k == 'fashion':
-			fashion_vals = v.split(',')
-			for fashion in fashion_vals:
-				fashion=fashion.strip()
-				if fashion == 'bold':
-					_a('font-weight', 'bold')
-				elif fashion == 'italic':
-					_a('font-style', 'italic')
-				elif fashion == 'upper':
-					_a('text-transform', 'uppercase')
-				elif fashion == 'lower':
-					_a('text-transform', 'lowercase')
-				elif fashion == 'line':
-					_a('text-decoration', 'underline')
-				elif fashion == 'strike':
-					_a('text-decoration', 'line-through')
-		elif k == 'display':
-			if v == 'floe':
-				_a('position', 'absolute')
-			elif v == 'anchored':
-				_a('position', 'fixed')
-			elif v == 'buoyed':
-				_a('position', 'sticky')
-			elif v == 'none':
-				_a('display', 'none')
-		elif k == 'x':
-			_a('left', f'{v}px')
-			_a('top', f'0px', 100)
-		elif k == 'y':
-			_a('top', f'{v}px')
-			_a('left', f'0px', 100)
-		elif k == 'z':
-			_a('z-index', v)
-		elif k == 'font':
-			_a('font-family', stml_rewrite_font(v))
-		elif k == 'orientation':
-			_a('display', 'flex')
-			if v == 'horizontal':
-				_a('flex-direction', 'row')
-				_a('justify-content', 'space-evenly')
-			elif v == 'vertical':
-				_a('flex-direction', 'column')
-		elif k == 'shadowAlpha':
+def _css_px(*props, specificness=0):
+	return lambda v, page_root: [(prop, f'{v}px', specificness) for prop in props]
+
+def _css_value(prop, values=None):
+	# values optionally maps STML values to CSS values, anything not in there is dropped
+	if values is None:
+		return lambda v, page_root: [(prop, v, 0)]
+	return lambda v, page_root: [(prop, values[v], 0)] if v in values else []
+
+def _css_size(prop):
+	def rule(v, page_root):
+		try:
+			return [(prop, f'{int(v)}px', 0)]
+		except ValueError:
+			return [(prop, v, 0)]
+	return rule
+
+def _css_align(v, page_root):
+	# align-self is not always correct for anything but left/right
+	return [('text-align', v, 0), ('align-self', {'left': 'start', 'right': 'end'}.get(v, v), 0)]
+
+def _css_fashion(v, page_root):
+	return [_STML_FASHIONS[fashion] for fashion in (f.strip() for f in v.split(',')) if fashion in _STML_FASHIONS]
+
+def _css_orientation(v, page_root):
+	return [('display', 'flex', 0)] + {
+		'horizontal': [('flex-direction', 'row', 0), ('justify-content', 'space-evenly', 0)],
+		'vertical': [('flex-direction', 'column', 0)],
+	}.get(v, [])
+
+_STML_FASHIONS = {
+	'bold': ('font-weight', 'bold', 0),
+	'italic': ('font-style', 'italic', 0),
+	'upper': ('text-transform', 'uppercase', 0),
+	'lower': ('text-transform', 'lowercase', 0),
+	'line': ('text-decoration', 'underline', 0),
+	'strike': ('text-decoration', 'line-through', 0),
+}
+
+# STML attribute -> rule returning a list of (css property, value, specificness) declarations.
+# Lower specificness = declaration will overwrite, 0 is most specific.
+_CSS_RULES = {
+	'backgroundColor': _css_value('background-color'),
+	'textColor': _css_value('color'),
+	'width': _css_size('width'),
+	'height': _css_size('height'),
+	'borderColor': lambda v, page_root: [('border-color', v, 0), ('border-style', 'solid', 0)],
+	'borderThickness': lambda v, page_root: [('border-width', f'{v}px', 0), ('border-style', 'solid', 0)],
+	'marginTop': _css_px('margin-top'),
+	'marginBottom': _css_px('margin-bottom'),
+	'marginLeft': _css_px('margin-left'),
+	'marginRight': _css_px('margin-right'),
+	'margin': _css_px('margin', specificness=2),
+	'marginVertical': _css_px('margin-top', 'margin-bottom', specificness=1),
+	'marginHorizontal': _css_px('margin-left', 'margin-right', specificness=1),
+	'padding': _css_px('padding'),
+	'align': _css_align,
+	'textSize': _css_px('font-size'),
+	'backgroundImage': lambda v, page_root: [('background-image', f'url(\'{_rewrite_ds_url(v, page_root)}\')', 0)],
+	# TODO slice
+	'backgroundRepeat': _css_value('background-repeat', {'x': 'repeat-x', 'y': 'repeat-y', 'none': 'no-repeat', 'xy': 'repeat'}),
+	'fashion': _css_fashion,
+	'display': lambda v, page_root: {
+		'floe': [('position', 'absolute', 0)],
+		'anchored': [('position', 'fixed', 0)],
+		'buoyed': [('position', 'sticky', 0)],
+		'none': [('display', 'none', 0)],
+	}.get(v, []),
+	'x': lambda v, page_root: [('left', f'{v}px', 0), ('top', '0px', 100)],
+	'y': lambda v, page_root: [('top', f'{v}px', 0), ('left', '0px', 100)],
+	'z': _css_value('z-index'),
+	'font': lambda v, page_root: [('font-family', stml_rewrite_font(v), 0)],
+	'orientation': _css_orientation,
+}
+
+# STML shadow attribute -> STMLStyleShadow field. CSS needs these combined into a single box-shadow.
+_SHADOW_FIELDS = {
+	'shadowAlpha': 'alpha',
+	'shadowColor': 'color',
+	'shadowBlur': 'blur_radius',
+	'shadowX': 'offset_x',
+	'shadowY': 'offset_y',
+}
+
+_CSS_ATTRIBUTES = frozenset(_CSS_RULES) | frozenset(_SHADOW_FIELDS)
+CSS_CACHE_SIZE = 4096
+
+def css_is_linkable(css):
+	"""
+	Whether sss CSS can be moved out of the page into a stylesheet of its own. It can't if it has
+	relative URLs, those would resolve against the stylesheet's URL rather than the page's.
+	"""
+	for url in re_css_url.findall(css):
+		parts = urlparse(url)
+		if not parts.scheme and not parts.path.startswith('/'):
+			return False
+	return True
+
+def stml_css(page_root, node: STMLNode):
+	"""Returns the inline CSS for a node's attributes, ready to be put in a style attribute."""
+	# only attributes that affect the CSS are part of the cache key, so ids/links/sources don't fragment it
+	return _compile_css(page_root, tuple(item for item in node._attributes.items() if item[0] in _CSS_ATTRIBUTES))
+
+@functools.lru_cache(maxsize=CSS_CACHE_SIZE)
+def _compile_css(page_root, attributes):
+	# attributes is a tuple of (name, value) pairs: order matters, it decides the order of the
+	# declarations and which of two equally specific declarations wins
+	declarations = {}
+	shadow = None
+	for k, v in attributes:
+		rule = _CSS_RULES.get(k)
+		if rule:
+			for prop, value, specificness in rule(v, page_root):
+				current = declarations.get(prop)
+				# we already have a more specific declaration, ignore this update
+				if current is None or specificness <= current[1]:
+					declarations[prop] = (value, specificness)
+			continue
+		if shadow is None:
+			shadow = STMLStyleShadow()
+		if k == 'shadowAlpha':
 			if v.isdigit():
 				shadow.alpha = int(v)
-		elif k == 'shadowColor':
-			shadow.color = v
-		elif k == 'shadowBlur':
-			shadow.blur_radius = v
-		elif k == 'shadowX':
-			shadow.offset_x = v
-		elif k == 'shadowY':
-			shadow.offset_y = v
-	if shadow.changed():
+		else:
+			setattr(shadow, _SHADOW_FIELDS[k], v)
+	if shadow is not None and shadow.changed():
 		# apply all shadow attributes as box-shadow in css
-		_a('box-shadow', str(shadow))
-	return [f'{k}: {v[0]}' for k, v in class_attributes.items()]
+		declarations['box-shadow'] = (str(shadow), 0)
+	return '; '.join(f'{k}: {v[0]}' for k, v in declarations.items())
 
 def _rewrite_ds_url(url, page_root):
 	fs = urlparse(url.replace('\\', '/'))
@@ -346,36 +604,184 @@ def _rewrite_ds_url(url, page_root):
 		fs = fs._replace(path=f'{fs.path.lstrip('/')}')
 	return urlunparse(fs)
 
-def stml_to_html(page_root, document):
-	parser = STMLParser()
-	parser.grammar = grammar
-	parsed = grammar.parse(document)
-	parser.visit(parsed)
-	html = '<!DOCTYPE html>\n'
+def iter_stml_html(page_root, document, engine=DEFAULT_ENGINE, link_stylesheet=None, budget=None):
+	"""
+	Returns an iterator over the HTML fragments of an STML page, in document order.
+	The document is parsed before this returns, so parse errors are raised here rather than
+	halfway through the output.
+
+	The page's sss block is inlined as a <style> element, unless `link_stylesheet` is given: it is
+	then called with the page's CSS and should return a URL the page can link to instead. sss blocks
+	with relative URLs are inlined either way, see css_is_linkable.
+
+	`budget` is an optional RenderBudget for parsing and rendering the page. RenderBudgetExceeded
+	is raised here if the document is too large, too many nodes or too slow to parse, or while
+	iterating if rendering runs out of time.
+	"""
+	return iter_stml_tree(page_root, parse_stml(document, engine, budget), link_stylesheet, budget)
+
+def iter_stml_tree(page_root, root_tags, link_stylesheet=None, budget=None):
+	"""Like iter_stml_html, for a page that was already parsed with parse_stml."""
 	style = ''
 	# preprocess certain tags so we can nest them in the html later
-	for node in parser.root_tags:
+	for node in root_tags:
 		if node.tag == 'sss':
-			style = visit_sss_node(page_root, node)
+			css = stml_sss_css(page_root, node)
+			if link_stylesheet is None or not css_is_linkable(css):
+				style = visit_sss_node(page_root, node)
+			elif css:
+				style = f'<link rel="stylesheet" href="{link_stylesheet(css)}">'
 			break
+	return _iter_page(page_root, style, root_tags, budget)
+
+def _iter_page(page_root, style, root_tags, budget):
+	yield '<!DOCTYPE html>\n'
 	# find stml tag and parse
-	for node in parser.root_tags:
+	for node in root_tags:
 		if node.tag == 'stml':
-			html += visit_stml_node(page_root, style, node)
+			yield from iter_stml_node(page_root, style, node, budget)
 			break
-	return html
 
+def stml_assets(page_root, root_tags):
+	"""
+	Returns the URLs of the images a parsed page references (image sources and background images,
+	including those of sss styles) as a tuple, rewritten like in the HTML, without duplicates and
+	in document order.
+	"""
+	assets = {}
+	stack = list(reversed(root_tags))
+	while stack:
+		node = stack.pop()
+		if not isinstance(node, STMLNode):
+			continue
+		# tags that aren't rendered don't load anything
+		if not stml_rewrite_tag(node):
+			continue
+		for name in ('source', 'backgroundImage'):
+			url = node._attributes.get(name)
+			if url:
+				assets.setdefault(_rewrite_ds_url(url, page_root), None)
+		stack.extend(reversed(node._children))
+	return tuple(assets)
+
+def stml_to_html(page_root, document, engine=DEFAULT_ENGINE):
+	return ''.join(iter_stml_html(page_root, document, engine))
 
-if __name__ == '__main__':
-	# command line usage
-	# TODO flags and a way to set page root, but not before href parsing/understanding is fixed
-	if len(sys.argv) <= 1:
-		print(f'usage: {sys.argv[0]} filename.stml')
-		raise SystemExit
+
+# Batch mode keeps track of what it rendered in this file in the output directory
+BATCH_MANIFEST = '.stml-manifest.json'
+re_stml_file = re.compile(r'\.stml?$')
+
+def render_file(src, dst, page_root, engine=DEFAULT_ENGINE):
+	"""Renders the STML file src to the HTML file dst, replacing dst only once rendering succeeded."""
+	with open(src) as f:
+		fragments = iter_stml_html(page_root, f.read(), engine)
+	os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+	tmp = f'{dst}.{os.getpid()}.tmp'
 	try:
-		f = open(sys.argv[1])
-	except FileNotFoundError:
-		print(f'file not found: {sys.argv[1]}')
-	else:
+		with open(tmp, 'w', encoding='utf-8') as f:
+			f.writelines(fragments)
+		os.replace(tmp, dst)
+	finally:
+		if os.path.exists(tmp):
+			os.unlink(tmp)
+
+def _batch_render(job):
+	rel, src, dst, page_root, engine = job
+	try:
+		render_file(src, dst, page_root, engine)
+	except Exception as e:
+		return rel, f'{type(e).__name__}: {e}'
+	return rel, None
+
+def render_tree(source, output, page_root, engine=DEFAULT_ENGINE, jobs=None, force=False):
+	"""
+	Renders every .stm/.stml file under source to the same relative path under output, with .html
+	appended, using a pool of `jobs` processes. Files whose mtime and size haven't changed since the
+	last run into the same output directory are skipped, unless `force` is set or the page root or
+	engine changed.
+	Returns (rendered, skipped, source bytes rendered, {relative path: error message}).
+	"""
+	manifest_path = os.path.join(output, BATCH_MANIFEST)
+	try:
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+	except (FileNotFoundError, ValueError):
+		manifest = {}
+	previous = {}
+	if not force and manifest.get('page_root') == page_root and manifest.get('engine') == engine:
+		previous = manifest.get('files', {})
+
+	files = {}
+	todo = []
+	todo_bytes = 0
+	for dirpath, dirnames, filenames in os.walk(source):
+		dirnames.sort()
+		for name in sorted(filenames):
+			if not re_stml_file.search(name):
+				continue
+			src = os.path.join(dirpath, name)
+			rel = os.path.relpath(src, source)
+			dst = os.path.join(output, rel + '.html')
+			st = os.stat(src)
+			files[rel] = [st.st_mtime_ns, st.st_size]
+			if previous.get(rel) == files[rel] and os.path.exists(dst):
+				continue
+			todo.append((rel, src, dst, page_root, engine))
+			todo_bytes += st.st_size
+
+	errors = {}
+	workers = jobs or os.cpu_count() or 1
+	with ProcessPoolExecutor(workers) if workers > 1 else nullcontext() as pool:
+		if pool:
+			results = pool.map(_batch_render, todo, chunksize=max(1, len(todo) // (4 * workers)))
+		else:
+			results = map(_batch_render, todo)
+		for rel, error in results:
+			if error:
+				errors[rel] = error
+				# not recorded, so it's retried next run
+				del files[rel]
+
+	os.makedirs(output, exist_ok=True)
+	with open(manifest_path, 'w') as f:
+		json.dump({'page_root': page_root, 'engine': engine, 'files': files}, f)
+	return len(todo) - len(errors), len(files) - len(todo) + len(errors), todo_bytes, errors
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Turns STML pages into HTML.')
+	parser.add_argument('source', help='STML file to print as HTML, or with --output, a directory tree to render')
+	parser.add_argument('-o', '--output', help='batch mode: render every .stm/.stml file under source into this directory')
+	parser.add_argument('--page-root', default='http://localhost:8000/browse',
+		help='root path to navigate to if a page wants to navigate to /')
+	parser.add_argument('--engine', choices=sorted(ENGINES), default=DEFAULT_ENGINE)
+	parser.add_argument('-j', '--jobs', type=int, default=None, help='batch mode: worker processes (default: one per CPU)')
+	parser.add_argument('-f', '--force', action='store_true', help='batch mode: also render files that did not change since the last run')
+	args = parser.parse_args(argv)
+
+	if args.output is None:
+		try:
+			f = open(args.source)
+		except FileNotFoundError:
+			print(f'file not found: {args.source}')
+			return 1
 		with f:
-			print(stml_to_html('http://localhost:8000/browse', f.read()))
+			print(stml_to_html(args.page_root, f.read(), args.engine))
+		return 0
+
+	if not os.path.isdir(args.source):
+		print(f'not a directory: {args.source}')
+		return 1
+	start = time.perf_counter()
+	rendered, skipped, nbytes, errors = render_tree(
+		args.source, args.output, args.page_root, args.engine, args.jobs, args.force)
+	elapsed = time.perf_counter() - start
+	print(f'rendered {rendered}, unchanged {skipped}, failed {len(errors)} in {elapsed:.2f}s '
+		f'({(rendered + len(errors)) / elapsed:.1f} files/s, {nbytes / elapsed / 1e6:.2f} MB/s)')
+	for rel, error in sorted(errors.items()):
+		print(f'  {rel}: {error}')
+	return 1 if errors else 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
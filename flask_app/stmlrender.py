@@ -1,40 +1,308 @@
-from flask import send_from_directory, Blueprint, make_response, redirect, url_for
+from flask import send_from_directory, Blueprint, Response, make_response, redirect, render_template, request, url_for
+from werkzeug.http import is_resource_modified, parse_range_header
+from werkzeug.security import safe_join
 from flask_login import login_required
-from flask_app import SFTP_ROOT
-from flask_app.stmlparse import stml_to_html
+from flask_app import app, SFTP_ROOT, PRERENDER_DIR, SSS_DIR, FAILURES_DIR
+from flask_app.dirindex import DirectoryIndex
+from flask_app.compression import negotiate, compress, is_compressible
+from flask_app.pagecache import RenderCache
+from flask_app.prerender import PrerenderStore, RenderFailures
+from flask_app.stylesheets import StylesheetStore, re_stylesheet_name
+from flask_app.stmlparse import iter_stml_tree, parse_stml, stml_assets, re_stml_file, RENDERER_VERSION, \
+    ParseError, RenderBudget, RenderBudgetExceeded
+from datetime import datetime, timezone
+import hashlib
+import mimetypes
 import os
-import re
+import stat
+from urllib.parse import quote, urlsplit
 
 bp = Blueprint('stmlrender', __name__, url_prefix='/browse')
 
+# Rendered pages are streamed to the client in chunks of roughly this many characters
+STREAM_CHUNK_SIZE = 16 * 1024
+PAGE_ROOT = '/browse'
+# Stylesheets are named after their contents, so they can be cached forever
+STYLESHEET_MAX_AGE = 365 * 24 * 3600
+ASSET_MAX_AGE = 604800
+# Static files larger than this are sent as is rather than compressed in memory
+COMPRESS_MAX_FILE_SIZE = 4 * 1024 * 1024
+# URLs in Link headers are percent-encoded except for these, which keeps ones that already are as they are
+PRELOAD_URL_SAFE = "/:?#[]@!$&'()*+;=%~"
+# STATIC_OFFLOAD values: the header that hands a page asset over to the reverse proxy
+OFFLOAD_HEADERS = {'x-accel-redirect': 'X-Accel-Redirect', 'x-sendfile': 'X-Sendfile'}
+if app.config['STATIC_OFFLOAD'] and app.config['STATIC_OFFLOAD'] not in OFFLOAD_HEADERS:
+    raise ValueError(f"STATIC_OFFLOAD must be one of {', '.join(OFFLOAD_HEADERS)}, not {app.config['STATIC_OFFLOAD']!r}")
+
+directories = DirectoryIndex(SFTP_ROOT)
+render_cache = RenderCache(app.config['STML_CACHE_BYTES'])
+# why pages that couldn't be rendered failed, so they aren't tried again until they change
+failed_renders = RenderFailures(FAILURES_DIR)
+stylesheets = StylesheetStore(SSS_DIR, f'{PAGE_ROOT}/_sss/')
+prerendered = PrerenderStore(SFTP_ROOT, PRERENDER_DIR) if app.config['STML_PRERENDER'] else None
+
+@bp.route('/_sss/<name>.css')
+def stylesheet(name):
+    # no login needed, like /static
+    if not re_stylesheet_name.match(name):
+        return make_response('File not found', 404)
+    response = send_from_directory(SSS_DIR, f'{name}.css', max_age=STYLESHEET_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@bp.before_app_request
+def compressed_static():
+    # flask's own static route can't negotiate encodings, serve compressible files in /static from here
+    if request.endpoint != 'static':
+        return None
+    path = safe_join(app.static_folder, request.view_args['filename'])
+    if path is None or not os.path.isfile(path):
+        return None
+    filename = request.view_args['filename']
+    return _compressed_file(path, os.stat(path), app.get_send_file_max_age(filename))
+
 @bp.route('/', defaults={"path":"./"})
 @bp.route('/<path:path>')
 @login_required
 def pages(path):
-    rpath = os.path.realpath(os.path.join(SFTP_ROOT, path))
-    if not re.match(f'^{SFTP_ROOT}($|/)', rpath):
+    rpath = directories.resolve(path)
+    if rpath is None:
         return make_response('File not found', 404)
-    if not os.path.exists(rpath):
+    try:
+        if re_stml_file.search(rpath):
+            return stml_page(rpath)
+        st = os.stat(rpath)
+    except (FileNotFoundError, NotADirectoryError):
         return make_response('File not found', 404)
-    if re.search(r'\.stml?$', rpath):
-        with open(rpath) as file:
-            return stml_parse(file.read())
-    if os.path.isdir(rpath):
+    if stat.S_ISDIR(st.st_mode):
         if path and path[-1] != '/':
             # add a trailing slash for directories so relative paths work properly
             # ideally directory links would already have a trailing slash,
             # but this is cheaper than directory-checking everything
             return redirect(url_for('stmlrender.pages', path=path+'/'))
-        response = ''
-        for f in os.listdir(rpath):
-            if f == 'main.stm' or f == 'main.stml':
-                stml_path = os.path.realpath(os.path.join(rpath, f))
-                with open(stml_path) as file:
-                    return stml_parse(file.read())
-            response += f'<li><a href="./{f}">{f}</a></li>\n'
-        return make_response(response)
-    return send_from_directory(SFTP_ROOT, path, max_age=604800)
-    
-def stml_parse(stml_str):
-    html = stml_to_html('/browse', stml_str)
-    return make_response(html)
+        listing = directories.get(rpath, st)
+        if listing.main:
+            try:
+                return stml_page(listing.main)
+            except FileNotFoundError:
+                # removed without the directory's mtime changing yet, e.g. on a coarse-grained filesystem
+                pass
+        # a listing only changes when entries are added, removed or renamed, which updates the directory's mtime
+        etag = _etag(rpath, st)
+        return _not_modified(etag, st, negotiated=False) or _with_validators(make_response(listing.html), etag, st)
+    _drop_unusable_range()
+    return _compressed_file(rpath, st, ASSET_MAX_AGE) or _offloaded(rpath, ASSET_MAX_AGE) or \
+        send_from_directory(SFTP_ROOT, path, max_age=ASSET_MAX_AGE)
+
+def render_budget():
+    """A new RenderBudget for rendering one page, as configured."""
+    return RenderBudget(app.config['STML_MAX_SIZE'], app.config['STML_MAX_NODES'], app.config['STML_MAX_RENDER_SECONDS'])
+
+def stml_page(stml_path):
+    st = os.stat(stml_path)
+    # checked before the 304, the client may hold a page that was cut off when it ran out of time
+    failed = failed_renders.get(stml_path, PAGE_ROOT, st)
+    if failed is not None:
+        return _render_error(stml_path, failed)
+    encoding = negotiate(request.accept_encodings)
+    etag = _etag(stml_path, st)
+    not_modified = _not_modified(etag, st, encoding)
+    if not_modified:
+        return not_modified
+    entry = render_cache.get(stml_path, PAGE_ROOT, st)
+    variants = entry.variants if entry is not None else {}
+    assets = entry.assets if entry is not None else ()
+    if 'identity' not in variants and prerendered:
+        loaded = prerendered.load(stml_path, PAGE_ROOT, st)
+        if loaded is not None:
+            html, assets = loaded
+            render_cache.put(stml_path, PAGE_ROOT, st, html, assets=assets)
+            variants = {'identity': html}
+    if 'identity' in variants:
+        data, encoding = _variant(stml_path, PAGE_ROOT, st, variants, encoding)
+        response = _encoded(make_response(data), encoding)
+        return _preload(_with_validators(response, _variant_etag(etag, encoding), st), assets)
+    # first view streams uncompressed, later views are served from the cache
+    budget = render_budget()
+    try:
+        # checked on the file before reading it, its size in bytes is at least its length in characters
+        budget.check_size(st.st_size)
+        with open(stml_path, encoding='utf-8') as file:
+            root_tags = parse_stml(file.read(), budget=budget)
+    except (ParseError, RenderBudgetExceeded, UnicodeDecodeError) as e:
+        return _render_failed(stml_path, st, e)
+    assets = stml_assets(PAGE_ROOT, root_tags)
+    fragments = iter_stml_tree(PAGE_ROOT, root_tags, stylesheets.link, budget)
+    chunks = _stop_over_budget(stml_path, st, render_cache.tee(stml_path, PAGE_ROOT, st, _chunked(fragments), assets))
+    response = _encoded(Response(chunks, mimetype='text/html'), None)
+    # no validators: the page may yet be cut off, a client must not revalidate its copy into a 304
+    response.headers['Cache-Control'] = app.config['STML_CACHE_CONTROL']
+    return _preload(response, assets)
+
+def _stop_over_budget(stml_path, st, chunks):
+    # the headers are out by the time rendering runs out of time, all that's left is to end the page
+    # early and remember it; the cache only keeps pages that were rendered completely
+    try:
+        yield from chunks
+    except RenderBudgetExceeded as e:
+        _record_failure(stml_path, st, e)
+
+def _render_failed(stml_path, st, error):
+    return _render_error(stml_path, _record_failure(stml_path, st, error))
+
+def _record_failure(stml_path, st, error):
+    """Logs and remembers why a page couldn't be rendered, returns the reason."""
+    if isinstance(error, ParseError):
+        reason = f'it isn\'t valid STML, at line {error.line()}, column {error.column()}'
+    elif isinstance(error, UnicodeDecodeError):
+        reason = 'it isn\'t valid UTF-8'
+    else:
+        reason = str(error)
+    app.logger.info(f'Could not render {stml_path}: {reason}')
+    failed_renders.put(stml_path, PAGE_ROOT, st, reason)
+    return reason
+
+def _render_error(stml_path, reason):
+    page = os.path.relpath(stml_path, directories.root)
+    return make_response(render_template('stml_error.html', page=page, reason=reason), 422)
+
+def _preload(response, assets):
+    """Adds Link preload headers for the first STML_PRELOAD_LINKS images of a page."""
+    links = []
+    for url in assets:
+        if len(links) >= app.config['STML_PRELOAD_LINKS']:
+            break
+        # inline data and odd schemes aren't worth a hint
+        if urlsplit(url).scheme not in ('', 'http', 'https'):
+            continue
+        links.append(f'<{quote(url, safe=PRELOAD_URL_SAFE)}>; rel=preload; as=image')
+    if links:
+        response.headers['Link'] = ', '.join(links)
+    return response
+
+def _variant(path, page_root, st, variants, encoding):
+    """Returns (data, encoding) to send, compressing the cached page the first time an encoding is asked for."""
+    if encoding is not None:
+        data = variants.get(encoding)
+        if data is not None:
+            return data, encoding
+        identity = variants['identity']
+        if len(identity) >= app.config['COMPRESS_MIN_SIZE'] and render_cache.max_bytes:
+            data = compress(identity, encoding, app.config['COMPRESS_LEVEL'])
+            render_cache.put(path, page_root, st, data, encoding)
+            return data, encoding
+    return variants['identity'], None
+
+def _compressed_file(path, st, max_age):
+    """
+    Returns a compressed response for a static file if the client accepts one and it's worth it,
+    otherwise None to have the file sent as is. Compressed copies are kept in the render cache.
+    """
+    # without a cache every response would have to be compressed again
+    if not render_cache.max_bytes or 'Range' in request.headers:
+        return None
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None or not is_compressible(path) or \
+            not app.config['COMPRESS_MIN_SIZE'] <= st.st_size <= COMPRESS_MAX_FILE_SIZE:
+        return None
+    cache_control = f'public, max-age={max_age}' if max_age else 'no-cache'
+    etag = _etag(path, st)
+    not_modified = _not_modified(etag, st, encoding, cache_control)
+    if not_modified:
+        return not_modified
+    entry = render_cache.get(path, None, st)
+    data = entry.variants.get(encoding) if entry is not None else None
+    if data is None:
+        with open(path, 'rb') as file:
+            data = compress(file.read(), encoding, app.config['COMPRESS_LEVEL'])
+        render_cache.put(path, None, st, data, encoding)
+    response = _encoded(Response(data, mimetype=mimetypes.guess_type(path)[0]), encoding)
+    return _with_validators(response, _variant_etag(etag, encoding), st, cache_control)
+
+def _offloaded(rpath, max_age):
+    """
+    With STATIC_OFFLOAD set, returns an empty response that has the reverse proxy send the file
+    itself (including ranges and conditional requests), so large downloads don't hold a worker thread.
+    Only called after the login and path checks.
+    """
+    mode = app.config['STATIC_OFFLOAD']
+    if not mode:
+        return None
+    if mode == 'x-accel-redirect':
+        # an internal location in nginx that aliases SFTP_ROOT, nginx unescapes the uri
+        target = app.config['STATIC_OFFLOAD_PREFIX'] + quote(os.path.relpath(rpath, directories.root), errors='surrogateescape')
+    else:
+        target = rpath
+    response = Response(mimetype=mimetypes.guess_type(rpath)[0] or 'application/octet-stream')
+    response.headers[OFFLOAD_HEADERS[mode]] = target
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+def _drop_unusable_range():
+    """
+    Makes send_file ignore Range headers that a server must or may ignore rather than answer with 416:
+    malformed ones, multiple ranges (only single ranges are supported) and ranges conditional on a weak
+    If-Range validator, which can never match.
+    """
+    environ = request.environ
+    if 'HTTP_RANGE' not in environ:
+        return
+    parsed = parse_range_header(environ['HTTP_RANGE'])
+    if parsed is None or len(parsed.ranges) != 1 or environ.get('HTTP_IF_RANGE', '').startswith('W/'):
+        del environ['HTTP_RANGE']
+
+def _etag(path, st):
+    # strong: the same source file, page root and renderer always render to the same bytes
+    identity = f'{path}\0{PAGE_ROOT}\0{st.st_mtime_ns}\0{st.st_size}\0{RENDERER_VERSION}'
+    return hashlib.blake2b(identity.encode('utf-8', 'surrogateescape'), digest_size=16).hexdigest()
+
+def _variant_etag(etag, encoding):
+    # each encoding is a different representation, so it needs its own strong etag
+    return f'{etag}-{encoding}' if encoding else etag
+
+def _not_modified(etag, st, encoding=None, cache_control=None, negotiated=True):
+    """
+    Returns a 304 response if the client's cached copy is still current, before anything is read.
+    A client may hold the variant in the negotiated encoding, or the uncompressed one it got first.
+    `negotiated` is whether the resource's encoding is negotiated, its 304s then carry the same
+    Vary header as its 200s whichever variant they are for.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    for candidate in dict.fromkeys((_variant_etag(etag, encoding), etag)):
+        if not is_resource_modified(request.environ, etag=candidate, last_modified=_last_modified(st)):
+            response = _encoded(Response(status=304), None) if negotiated else Response(status=304)
+            return _with_validators(response, candidate, st, cache_control)
+    return None
+
+def _encoded(response, encoding):
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def _with_validators(response, etag, st, cache_control=None):
+    response.set_etag(etag)
+    response.last_modified = _last_modified(st)
+    response.headers['Cache-Control'] = cache_control or app.config['STML_CACHE_CONTROL']
+    return response
+
+def _last_modified(st):
+    return datetime.fromtimestamp(st.st_mtime, timezone.utc)
+
+def _chunked(fragments, size=STREAM_CHUNK_SIZE):
+    # the renderer yields many tiny fragments, group them so each write to the client is worthwhile
+    buf = []
+    buf_len = 0
+    for fragment in fragments:
+        buf.append(fragment)
+        buf_len += len(fragment)
+        if buf_len >= size:
+            yield ''.join(buf)
+            buf = []
+            buf_len = 0
+    if buf:
+        yield ''.join(buf)
+
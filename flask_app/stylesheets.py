@@ -0,0 +1,109 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from parsimonious.exceptions import ParseError
+from flask_app.stmlparse import css_is_linkable, parse_stml, re_stml_file, stml_sss_css, RenderBudgetExceeded
+
+re_stylesheet_name = re.compile(r'^[0-9a-f]{32}$')
+
+
+class StylesheetStore:
+    """
+    Content-addressed store for the CSS generated from pages' sss blocks. Stylesheets are files named
+    after a hash of their contents, so every worker (and the SFTP process when prerendering) can add
+    to and serve from the same directory, and a stylesheet never changes once it has a name.
+
+    `link` can be passed as `link_stylesheet` to the STML renderer. It returns `url_prefix` followed
+    by the stylesheet's name.
+
+    Stylesheets are never removed when the pages using them change, `prune` removes the ones no page
+    links to anymore.
+    """
+
+    # a stylesheet that is linked again gets its mtime updated at most this often, so prune can tell
+    # it's still in use without every render writing to the disk
+    TOUCH_INTERVAL = 3600
+
+    def __init__(self, directory, url_prefix):
+        self.directory = directory
+        self.url_prefix = url_prefix
+
+    def add(self, css):
+        name = stylesheet_name(css)
+        path = self.path(name)
+        # checked every time, prune runs in another process and may have removed it
+        try:
+            if os.stat(path).st_mtime < time.time() - self.TOUCH_INTERVAL:
+                os.utime(path)
+            return name
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(css.encode('utf-8'))
+        os.replace(tmp, path)
+        return name
+
+    def link(self, css):
+        return f'{self.url_prefix}{self.add(css)}.css'
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.css')
+
+    def prune(self, keep, min_age):
+        """
+        Removes the stylesheets whose names aren't in `keep` and that weren't added or linked in the
+        last `min_age` seconds, so pages rendered just before still find theirs. `min_age` should be
+        longer than TOUCH_INTERVAL. Returns the names removed.
+        """
+        try:
+            entries = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        cutoff = time.time() - min_age
+        removed = []
+        for entry in entries:
+            name, ext = os.path.splitext(entry)
+            if ext != '.css' or not re_stylesheet_name.match(name) or name in keep:
+                continue
+            path = self.path(name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+                    removed.append(name)
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def stylesheet_name(css):
+    return hashlib.sha256(css.encode('utf-8')).hexdigest()[:32]
+
+
+def linked_stylesheets(root, page_root, make_budget=None):
+    """
+    Returns the names of the stylesheets the STML pages under `root` link to when rendered as they
+    are now. Pages that can't be read or parsed are skipped. `make_budget` returns the RenderBudget
+    each page is parsed with.
+    """
+    names = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if not re_stml_file.search(filename):
+                continue
+            budget = make_budget() if make_budget else None
+            try:
+                with open(os.path.join(dirpath, filename), encoding='utf-8') as file:
+                    root_tags = parse_stml(file.read(), budget=budget)
+            except (OSError, ParseError, RenderBudgetExceeded, UnicodeDecodeError):
+                continue
+            for node in root_tags:
+                if node.tag == 'sss':
+                    css = stml_sss_css(page_root, node)
+                    if css and css_is_linkable(css):
+                        names.add(stylesheet_name(css))
+                    break
+    return names
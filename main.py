@@ -4,19 +4,43 @@ import threading
 from signal import pthread_kill, SIGINT
 from flask import redirect, url_for, render_template
 from flask_login import current_user
-from flask_app import app, db, login, SFTP_ROOT, DATA_DIR
+from flask_app import app, db, login, SFTP_ROOT, DATA_DIR, PRERENDER_DIR
 from flask_app.auth import bp as auth_bp
-from flask_app.manager import bp as manager_bp
+from flask_app.manager import bp as manager_bp, ownership
 from flask_app.stmlrender import bp as stml_bp
 from flask_app.models import User
+from flask_app.prerender import PrerenderStore, Prerenderer
+from flask_app.stmlrender import PAGE_ROOT, render_budget, stylesheets
+from flask_app.stylesheets import linked_stylesheets
+from sftp_server.audit import AuditLog
+from sftp_server.metrics import serve_metrics
 from sftp_server.sftp import SFTPServer
+from sftp_server.sessions import SessionLimits
 from sftp_server.permissions_manager import PermissionsManager
+from sftp_server.quota import Quotas, reconcile
 from sftp_server.sqlite_auth import SQLiteAuth
 
-_HOST_KEY = os.path.realpath(os.path.join(DATA_DIR, 'host_key'))
-_sqlite_auth = SQLiteAuth(app, db)
+_HOST_KEYS = [os.path.realpath(os.path.join(DATA_DIR, name)) for name in app.config['SFTP_HOST_KEYS']]
+_sqlite_auth = SQLiteAuth(app, db, ttl=app.config['SFTP_AUTH_CACHE_TTL'], stamps=ownership)
 _manager = PermissionsManager(authenticate=_sqlite_auth)
-sftp_server = SFTPServer(SFTP_ROOT, _HOST_KEY, get_user=_manager.get_user)
+_prerenderer = None
+if app.config['STML_PRERENDER']:
+    _prerenderer = Prerenderer(PrerenderStore(SFTP_ROOT, PRERENDER_DIR), PAGE_ROOT, stylesheets.link, render_budget)
+_session_limits = SessionLimits(max_sessions=app.config['SFTP_MAX_SESSIONS'],
+                                max_per_ip=app.config['SFTP_MAX_SESSIONS_PER_IP'],
+                                max_per_user=app.config['SFTP_MAX_SESSIONS_PER_USER'])
+_audit = AuditLog(app.config['SFTP_AUDIT_LOG'] or None, max_queue=app.config['SFTP_AUDIT_QUEUE'],
+                  read_sample=app.config['SFTP_AUDIT_READ_SAMPLE'])
+_quotas = Quotas(app, db, page_bytes=app.config['QUOTA_PAGE_BYTES'], page_files=app.config['QUOTA_PAGE_FILES'],
+                 user_bytes=app.config['QUOTA_USER_BYTES'], user_files=app.config['QUOTA_USER_FILES'])
+sftp_server = SFTPServer(SFTP_ROOT, _HOST_KEYS, get_user=_manager.get_user,
+                         on_write=_prerenderer.enqueue if _prerenderer else None,
+                         limits=_session_limits, login_timeout=app.config['SFTP_LOGIN_TIMEOUT'],
+                         socket_backlog=app.config['SFTP_SOCKET_BACKLOG'],
+                         listing_max=app.config['SFTP_LISTING_MAX'], audit=_audit,
+                         quotas=_quotas,
+                         kex=app.config['SFTP_KEX'], ciphers=app.config['SFTP_CIPHERS'],
+                         macs=app.config['SFTP_MACS'])
 
 @login.user_loader
 def load_user(id):
@@ -29,6 +53,11 @@ def index():
     return render_template('index.html')
 
 def run_sftp_server():
+    # the quotas keep their usage in the database
+    with app.app_context():
+        db.create_all()
+    if app.config['SFTP_METRICS_PORT']:
+        serve_metrics(sftp_server, app.config['SFTP_METRICS_HOST'], app.config['SFTP_METRICS_PORT'])
     print("serving SFTP", flush=True)
     sftp_server.serve_forever('0.0.0.0', 5001)
 
@@ -50,4 +79,18 @@ if __name__ == '__main__' and os.getenv('DEBUG') == 'true':
     thread.join()
 
 if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'sftp':
-    run_sftp_server()
\ No newline at end of file
+    run_sftp_server()
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'reconcile-usage':
+    with app.app_context():
+        db.create_all()
+    for page, (nbytes, nfiles) in sorted(reconcile(app, db, SFTP_ROOT).items()):
+        print(f"{page}: {nbytes} bytes, {nfiles} files")
+
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == 'prune-stylesheets':
+    # stylesheets added in the last day are kept, pages rendered from an older version may still link to them
+    min_age = float(sys.argv[2]) * 3600 if len(sys.argv) > 2 else 24 * 3600
+    if min_age <= stylesheets.TOUCH_INTERVAL:
+        sys.exit(f"HOURS has to be more than {stylesheets.TOUCH_INTERVAL / 3600:g}")
+    removed = stylesheets.prune(linked_stylesheets(SFTP_ROOT, PAGE_ROOT, render_budget), min_age)
+    print(f"removed {len(removed)} stylesheets")
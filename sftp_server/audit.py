@@ -0,0 +1,137 @@
+import bisect
+import collections
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram(object):
+    """
+    Counts of observed durations in seconds, by the first of `BOUNDS` they
+    don't exceed, and one more for everything slower.
+    """
+
+    BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+              0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        return {'bounds': self.BOUNDS, 'counts': list(self.counts), 'count': self.count, 'sum': self.sum}
+
+
+class AuditLog(object):
+    """
+    Structured log of SFTP operations, written by a background thread.
+
+    `record` is called on the session thread. It adds the operation's
+    duration to a latency histogram for that operation and puts the record
+    on a queue of at most `max_queue` records, without waiting: when the
+    queue is full the record is counted in `dropped` instead. The writer
+    thread takes records off the queue up to `batch_size` at a time and
+    appends them as JSON lines to the file `path` (stderr for '-'),
+    flushing once per batch, or if no path is given, logs each line through
+    the `sftp_server.audit` logger.
+
+    Successful read-only operations are only written with a probability of
+    `read_sample`; the latency histograms still count all of them.
+    """
+
+    READ_ONLY_OPS = frozenset(('stat', 'lstat', 'list_folder', 'readlink'))
+
+    def __init__(self, path=None, max_queue=10000, batch_size=256, read_sample=1.0):
+        self.path = path
+        self.stream = None
+        self.batch_size = batch_size
+        self.read_sample = read_sample
+        self.queue = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.latency = collections.defaultdict(LatencyHistogram)
+        self.dropped = 0
+        self.sampled_out = 0
+        self.written = 0
+        self.thread = None
+
+    def record(self, user, op, path, result, duration, nbytes=None):
+        with self.lock:
+            self.latency[op].observe(duration)
+            if result == 'ok' and op in self.READ_ONLY_OPS and \
+                    self.read_sample < 1 and random.random() >= self.read_sample:
+                self.sampled_out += 1
+                return
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='audit', daemon=True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait((time.time(), str(user), op, path, result, nbytes, duration))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            try:
+                self.write(batch)
+            except Exception as e:
+                logger.warning('Writing %d audit records failed: %s', len(batch), e)
+            for _ in batch:
+                self.queue.task_done()
+
+    def write(self, batch):
+        lines = [json.dumps({
+            'time': round(when, 6),
+            'user': user,
+            'op': op,
+            'path': path,
+            'result': result,
+            'bytes': nbytes,
+            'duration': round(duration, 6),
+        }) for when, user, op, path, result, nbytes, duration in batch]
+        if self.path is not None:
+            if self.stream is None:
+                self.stream = sys.stderr if self.path == '-' else open(self.path, 'a', encoding='utf-8')
+            self.stream.write('\n'.join(lines) + '\n')
+            self.stream.flush()
+        else:
+            for line in lines:
+                logger.info(line)
+        with self.lock:
+            self.written += len(batch)
+
+    def flush(self):
+        """Waits until every record queued so far has been written."""
+        self.queue.join()
+
+    def latencies(self):
+        """Returns a snapshot of the latency histogram of each operation."""
+        with self.lock:
+            return {op: histogram.snapshot() for op, histogram in self.latency.items()}
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'sampled_out': self.sampled_out,
+            }
@@ -0,0 +1,119 @@
+import collections
+import http.server
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Metrics(object):
+    """
+    Counters of SFTP server events that `SessionLimits` and `AuditLog` don't
+    already keep: connections accepted, logins by result and bytes read and
+    written through file handles.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def render_metrics(server):
+    """
+    Return the metrics of the SFTPServer `server` in the Prometheus text
+    format.
+    """
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for suffix, labels, value in samples:
+            label_text = ','.join('%s="%s"' % (label, _escape(text)) for label, text in labels)
+            lines.append('%s%s%s %s' % (name, suffix, '{%s}' % label_text if label_text else '', _number(value)))
+
+    stats = server.stats()
+    counters = server.metrics.snapshot()
+    metric('sftp_sessions', 'gauge', 'Open SFTP connections.', [('', (), stats['sessions'])])
+    metric('sftp_session_addresses', 'gauge', 'Addresses with open SFTP connections.',
+           [('', (), stats['addresses'])])
+    metric('sftp_session_users', 'gauge', 'Users with logged in SFTP sessions.', [('', (), stats['users'])])
+    metric('sftp_logging_in', 'gauge', 'SFTP connections that have not logged in yet.',
+           [('', (), stats['logging_in'])])
+    metric('sftp_connections_total', 'counter', 'SFTP connections accepted.',
+           [('', (), counters.get('connections', 0))])
+    metric('sftp_connections_rejected_total', 'counter', 'SFTP connections and logins turned away by session limits.',
+           [('', (('reason', reason),), count) for reason, count in sorted(stats['rejected'].items())])
+    metric('sftp_logins_total', 'counter',
+           'SFTP password checks by result, rejected being a right password turned away by a session limit.',
+           [('', (('result', result),), counters.get('login_' + result, 0))
+            for result in ('success', 'failure', 'rejected')])
+    metric('sftp_read_bytes_total', 'counter', 'Bytes read through SFTP file handles, counted when they are closed.',
+           [('', (), counters.get('read_bytes', 0))])
+    metric('sftp_written_bytes_total', 'counter', 'Bytes written through SFTP file handles, counted when they are closed.',
+           [('', (), counters.get('written_bytes', 0))])
+
+    samples = []
+    for op, histogram in sorted(server.audit.latencies().items()):
+        cumulative = 0
+        for bound, count in zip(histogram['bounds'] + ('+Inf',), histogram['counts']):
+            cumulative += count
+            samples.append(('_bucket', (('op', op), ('le', _number(bound))), cumulative))
+        samples.append(('_sum', (('op', op),), histogram['sum']))
+        samples.append(('_count', (('op', op),), histogram['count']))
+    metric('sftp_operation_duration_seconds', 'histogram', 'Time taken by SFTP operations.', samples)
+
+    audit = server.audit.stats()
+    metric('sftp_audit_queue', 'gauge', 'Audit records waiting to be written.', [('', (), audit['queued'])])
+    metric('sftp_audit_records_total', 'counter', 'Audit records by what became of them.',
+           [('', (('outcome', outcome),), audit[outcome]) for outcome in ('written', 'dropped', 'sampled_out')])
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    # set by serve_metrics
+    sftp_server = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_metrics(self.sftp_server).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(server, host, port):
+    """
+    Serve the metrics of the SFTPServer `server` at /metrics on `host` and
+    `port` from a background thread. Returns the HTTP server.
+    """
+    handler = type('MetricsHandler', (MetricsHandler,), {'sftp_server': server})
+    httpd = http.server.ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name='metrics', daemon=True).start()
+    return httpd
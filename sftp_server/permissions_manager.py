@@ -9,9 +9,10 @@ class PermissionsManager(object):
     password and return a list of groups to which they belong (or None if the
     credentials are invalid)
 
-    The permissions are specified via a dict which maps paths to sets of groups
-    which have write access on that path. (Write access on a path implies write
-    access on all its children.)
+    The permissions are specified as the list of page directories a user
+    owns, which they have write access to. (Write access on a path implies
+    write access on all its children.) Paths are matched on whole components,
+    so owning `foo.zed` doesn't give access to `foo.zedx`.
 
     All valid users have read access to all files.
 
@@ -34,7 +35,7 @@ class PermissionsManager(object):
     def get_user(self, username, password):
         try:
             pages = self.authenticate(username, password)
-            return User(self, pages, username)
+            return User(self, OwnedRoots(pages), username)
         except AuthenticationError:
             return None
 
@@ -43,15 +44,67 @@ class PermissionsManager(object):
         return True
 
     def has_write_access(self, path, pages, block_root=False):
+        # `pages` is an OwnedRoots
         if not self.authenticate:
             return False
-        for owned_site in pages:
-            if path.startswith(owned_site):
-                if block_root and path == owned_site:
-                    return False
+        if path in pages.roots:
+            return not block_root
+        return pages.contains(path)
+
+
+class OwnedRoots(object):
+    """
+    Index of the page directories a user owns, built once per session.
+
+    `contains` checks whether a path is inside one of them with one set lookup
+    per path component, up to the depth of the deepest owned directory, so it
+    costs the same however many pages the user owns. For the usual handful of
+    pages a single `startswith` over all of them is cheaper still.
+    """
+
+    # up to this many pages are checked with startswith
+    PREFIX_SCAN_MAX = 16
+
+    def __init__(self, pages):
+        self.roots = frozenset(page.strip('/') for page in pages)
+        self.depth = max((root.count('/') + 1 for root in self.roots), default=0)
+        self.prefixes = None
+        if len(self.roots) <= self.PREFIX_SCAN_MAX:
+            self.prefixes = tuple(root + '/' for root in self.roots)
+
+    def contains(self, path):
+        """True if `path` is inside one of the owned directories, not counting the directories themselves."""
+        if self.prefixes is not None:
+            return path.startswith(self.prefixes)
+        roots = self.roots
+        end = -1
+        for _ in range(self.depth):
+            end = path.find('/', end + 1)
+            if end < 0:
+                return False
+            if path[:end] in roots:
                 return True
         return False
 
+    def root_of(self, path):
+        """Returns the owned directory `path` is or is inside of, or None."""
+        if path in self.roots:
+            return path
+        end = -1
+        for _ in range(self.depth):
+            end = path.find('/', end + 1)
+            if end < 0:
+                return None
+            if path[:end] in self.roots:
+                return path[:end]
+        return None
+
+    def __iter__(self):
+        return iter(self.roots)
+
+    def __len__(self):
+        return len(self.roots)
+
 
 class User(object):
 
@@ -0,0 +1,157 @@
+import collections
+import errno
+import os
+import stat
+import threading
+import time
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects.sqlite import insert
+
+from flask_app.models import DSPage, PageUsage
+
+
+class Quotas(object):
+    """
+    Storage used by each page directory, and limits on it.
+
+    Usage is kept in the page_usage table as bytes (the sizes of the files in
+    the page) and files (files and directories, not counting the page
+    directory itself). The SFTP server calls `change` after every operation
+    that adds or removes something, which adds the difference to the page's
+    row, and `check` before operations that grow a page. Bytes written
+    through open handles are only counted in memory with `reserve` until the
+    handle is closed and `release`s them.
+
+    `page_bytes` and `page_files` limit each page, `user_bytes` and
+    `user_files` all pages of a session's user together; None doesn't limit.
+    Usage read from the database is kept in memory for `refresh` seconds, so
+    a reconciliation shows up within that time.
+    """
+
+    def __init__(self, app, db, page_bytes=None, page_files=None, user_bytes=None, user_files=None, refresh=60):
+        self.app = app
+        self.db = db
+        self.page_bytes = page_bytes
+        self.page_files = page_files
+        self.user_bytes = user_bytes
+        self.user_files = user_files
+        self.refresh = refresh
+        self.lock = threading.Lock()
+        # page -> (bytes, files, when it was read)
+        self.used = {}
+        # page -> bytes reserved by open handles
+        self.reserved = collections.Counter()
+
+    def usage(self, page):
+        """Returns (bytes, files) in `page`, counting bytes reserved by open handles."""
+        nbytes, nfiles = self._used(page)
+        with self.lock:
+            return nbytes + self.reserved[page], nfiles
+
+    def check(self, pages, page, nbytes=0, nfiles=0):
+        """
+        Raises OSError(EDQUOT) if adding `nbytes` and `nfiles` to `page`, one
+        of the user's `pages`, would go over a limit.
+        """
+        if nbytes <= 0 and nfiles <= 0:
+            return
+        used_bytes, used_files = self.usage(page)
+        _check_limit(self.page_bytes, used_bytes, nbytes)
+        _check_limit(self.page_files, used_files, nfiles)
+        if self.user_bytes is not None or self.user_files is not None:
+            totals = [self.usage(other) for other in pages]
+            _check_limit(self.user_bytes, sum(used[0] for used in totals), nbytes)
+            _check_limit(self.user_files, sum(used[1] for used in totals), nfiles)
+
+    def reserve(self, pages, page, nbytes):
+        self.check(pages, page, nbytes)
+        with self.lock:
+            self.reserved[page] += nbytes
+
+    def release(self, page, nbytes):
+        with self.lock:
+            self.reserved[page] -= nbytes
+            if self.reserved[page] <= 0:
+                del self.reserved[page]
+
+    def change(self, page, nbytes=0, nfiles=0):
+        """Adds `nbytes` and `nfiles`, either of which may be negative, to the usage of `page`."""
+        if not nbytes and not nfiles:
+            return
+        statement = insert(PageUsage).values(path=page, bytes=max(nbytes, 0), files=max(nfiles, 0))
+        # usage that was never reconciled can't go below nothing
+        statement = statement.on_conflict_do_update(index_elements=[PageUsage.path], set_={
+            'bytes': func.max(PageUsage.bytes + nbytes, 0),
+            'files': func.max(PageUsage.files + nfiles, 0),
+        }).returning(PageUsage.bytes, PageUsage.files)
+        with self.app.app_context():
+            used_bytes, used_files = self.db.session.execute(statement).one()
+            self.db.session.commit()
+        with self.lock:
+            self.used[page] = (used_bytes, used_files, time.monotonic())
+
+    def usage_of(self, path):
+        """Returns (bytes, files) that `path` takes up, (0, 0) if it doesn't exist."""
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return 0, 0
+        if stat.S_ISDIR(st.st_mode):
+            nbytes, nfiles = scan_usage(path)
+            return nbytes, nfiles + 1
+        return st.st_size, 1
+
+    def _used(self, page):
+        with self.lock:
+            entry = self.used.get(page)
+        if entry is not None and entry[2] > time.monotonic() - self.refresh:
+            return entry[:2]
+        with self.app.app_context():
+            row = self.db.session.get(PageUsage, page)
+            used = (row.bytes, row.files) if row is not None else (0, 0)
+        with self.lock:
+            self.used[page] = used + (time.monotonic(),)
+        return used
+
+
+def _check_limit(limit, used, adding):
+    if limit is not None and adding > 0 and used + adding > limit:
+        raise OSError(errno.EDQUOT, os.strerror(errno.EDQUOT))
+
+
+def scan_usage(path):
+    """Returns (bytes, files) under the directory `path`, not counting itself."""
+    nbytes = nfiles = 0
+    directories = [path]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                nfiles += 1
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                else:
+                    nbytes += entry.stat(follow_symlinks=False).st_size
+    return nbytes, nfiles
+
+
+def reconcile(app, db, root):
+    """
+    Scans every page directory under `root` and replaces the page_usage
+    table with what it found. Changes made through the SFTP server during
+    the scan may be miscounted, so run it while the server is stopped.
+    Returns {page: (bytes, files)}.
+    """
+    with app.app_context():
+        pages = [page.get_uri() for page in db.session.scalars(db.select(DSPage))]
+    usage = {}
+    for page in pages:
+        try:
+            usage[page] = scan_usage(os.path.join(root, page))
+        except FileNotFoundError:
+            usage[page] = (0, 0)
+    with app.app_context():
+        db.session.execute(delete(PageUsage))
+        db.session.add_all(PageUsage(path=page, bytes=nbytes, files=nfiles) for page, (nbytes, nfiles) in usage.items())
+        db.session.commit()
+    return usage
@@ -0,0 +1,73 @@
+import collections
+import threading
+
+
+class SessionLimits(object):
+    """
+    Admission control for SFTP sessions.
+
+    Caps the number of concurrent sessions in total and per source IP, which are
+    checked when a connection is accepted, and per authenticated user, which is
+    checked when a user logs in. None disables a limit.
+
+    Every connection that `admit` lets in must be given back with `release` once
+    it has ended, along with the user it logged in as, if any. Rejections are
+    counted by reason in `rejected`.
+    """
+
+    def __init__(self, max_sessions=None, max_per_ip=None, max_per_user=None):
+        self.max_sessions = max_sessions
+        self.max_per_ip = max_per_ip
+        self.max_per_user = max_per_user
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.per_ip = collections.Counter()
+        self.per_user = collections.Counter()
+        self.rejected = collections.Counter()
+
+    def admit(self, ip):
+        """Takes a session slot for a new connection from `ip`. Returns None, or why it was rejected."""
+        with self.lock:
+            if self.max_sessions is not None and self.sessions >= self.max_sessions:
+                return self._reject('too many sessions')
+            if self.max_per_ip is not None and self.per_ip[ip] >= self.max_per_ip:
+                return self._reject('too many sessions from this address')
+            self.sessions += 1
+            self.per_ip[ip] += 1
+            return None
+
+    def admit_user(self, user):
+        """Counts a session as logged in as `user`. Returns None, or why it was rejected."""
+        with self.lock:
+            if self.max_per_user is not None and self.per_user[user] >= self.max_per_user:
+                return self._reject('too many sessions for this user')
+            self.per_user[user] += 1
+            return None
+
+    def count_rejection(self, reason):
+        with self.lock:
+            self.rejected[reason] += 1
+
+    def release(self, ip, user=None):
+        with self.lock:
+            self.sessions -= 1
+            self.per_ip[ip] -= 1
+            if not self.per_ip[ip]:
+                del self.per_ip[ip]
+            if user is not None:
+                self.per_user[user] -= 1
+                if not self.per_user[user]:
+                    del self.per_user[user]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'sessions': self.sessions,
+                'addresses': len(self.per_ip),
+                'users': len(self.per_user),
+                'rejected': dict(self.rejected),
+            }
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        return reason
@@ -1,16 +1,37 @@
+import errno
 import functools
 import logging
 import os
 import socket
 import threading
+import time
+from stat import S_ISDIR
 
 import paramiko
 
+from sftp_server.audit import AuditLog
+from sftp_server.metrics import Metrics
+from sftp_server.sessions import SessionLimits
+
+# Algorithms offered to clients, in order of preference. The client picks
+# the first of its own preferences that's on the list, so what matters most
+# is what's left off: SHA-1, CBC modes and all but the cheapest finite field
+# key exchange, which costs ten times the CPU of curve25519, kept for
+# clients that support nothing else.
+PREFERRED_KEX = (
+    'curve25519-sha256@libssh.org', 'ecdh-sha2-nistp256', 'ecdh-sha2-nistp384', 'ecdh-sha2-nistp521',
+    'diffie-hellman-group14-sha256')
+PREFERRED_CIPHERS = (
+    'aes128-gcm@openssh.com', 'aes256-gcm@openssh.com', 'aes128-ctr', 'aes192-ctr', 'aes256-ctr')
+PREFERRED_MACS = (
+    'hmac-sha2-256-etm@openssh.com', 'hmac-sha2-512-etm@openssh.com', 'hmac-sha2-256', 'hmac-sha2-512')
+
 
 class SFTPServer(object):
     """
     Create an SFTP server which serves the files in `root` and authenticates
-    itself with the supplied `host key` file.
+    itself with the supplied host key file, or list of them. Keys can be
+    RSA, ECDSA or Ed25519; clients pick the type they prefer among them.
 
     `serve_forver` starts the server listening on the supplied host and port
     and handles each connection in a new thread.
@@ -23,54 +44,188 @@ class SFTPServer(object):
     `has_write_access`.  Each method should accept a path (relative to `root`)
     and return True or False appropriately. Users should also have a sensible
     `__str__` representation for use in logging.
+
+    An `on_write` callback can optionally be supplied. It is called with the
+    full path of a file whose contents may have changed: after a handle that
+    was opened for writing is closed, after the file is removed, and with
+    both paths after a rename.
+
+    `limits` is an optional `SessionLimits` capping concurrent sessions in
+    total, per source address and per user; connections over a limit are
+    closed right away. A connection that hasn't logged in `login_timeout`
+    seconds after it was accepted is closed too. Connections waiting to be
+    accepted queue up in the listen backlog, at most `socket_backlog` of them.
+
+    Directory listings are cut off after `listing_max` entries, if set.
+
+    Every SFTP operation is recorded in `audit`, an optional `AuditLog`.
+
+    `quotas` is an optional `Quotas` that keeps track of the storage each
+    page uses and refuses writes over its limits. Users must then have
+    `pages`, the `OwnedRoots` they have write access to.
+
+    `kex`, `ciphers` and `macs` are the algorithms offered to clients, in
+    order of preference. They default to the ones paramiko supports of
+    `PREFERRED_KEX`, `PREFERRED_CIPHERS` and `PREFERRED_MACS`. ValueError
+    is raised for any given that paramiko doesn't support.
+
+    `metrics` counts connections, logins and bytes transferred, and together
+    with `limits`, `stats` and the latencies in `audit` is what
+    `sftp_server.metrics.serve_metrics` exposes.
     """
 
     SOCKET_BACKLOG = 10
-
-    def __init__(self, root, host_key_path, get_user=None):
+    LOGIN_TIMEOUT = 30
+    # how often the accept loop wakes up to close connections past their login timeout
+    REAP_INTERVAL = 1
+
+    def __init__(self, root, host_key_path, get_user=None, on_write=None,
+                 limits=None, login_timeout=LOGIN_TIMEOUT, socket_backlog=SOCKET_BACKLOG,
+                 listing_max=None, audit=None, quotas=None,
+                 kex=None, ciphers=None, macs=None):
         self.root = root
-        self.host_key = paramiko.RSAKey.from_private_key_file(host_key_path)
+        if isinstance(host_key_path, str):
+            host_key_path = [host_key_path]
+        self.host_keys = [paramiko.PKey.from_path(path) for path in host_key_path]
+        self.kex = check_algorithms('key exchange', kex, PREFERRED_KEX, paramiko.Transport._kex_info)
+        self.ciphers = check_algorithms('cipher', ciphers, PREFERRED_CIPHERS, paramiko.Transport._cipher_info)
+        self.macs = check_algorithms('MAC', macs, PREFERRED_MACS, paramiko.Transport._mac_info)
+        self.on_write = on_write
         if get_user is not None:
             self.get_user = get_user
+        self.limits = limits if limits is not None else SessionLimits()
+        self.login_timeout = login_timeout
+        self.socket_backlog = socket_backlog
+        self.listing_max = listing_max
+        self.audit = audit if audit is not None else AuditLog()
+        self.quotas = quotas
+        self.metrics = Metrics()
+        # transports that haven't logged in yet -> (when they have to be closed, peer address)
+        self.logging_in = {}
+        self.lock = threading.Lock()
 
     def serve_forever(self, host, port):
         server_socket = socket.socket()
         server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, True)
         server_socket.bind((host, port))
-        server_socket.listen(self.SOCKET_BACKLOG)
+        server_socket.listen(self.socket_backlog)
+        server_socket.settimeout(self.REAP_INTERVAL)
         while True:
-            conn = server_socket.accept()[0]
-            self.start_sftp_session(conn)
-
-    def start_sftp_session(self, conn):
-        transport = paramiko.Transport(conn)
-        transport.add_server_key(self.host_key)
+            try:
+                conn, address = server_socket.accept()
+            except socket.timeout:
+                conn = None
+            self.close_expired_logins()
+            if conn is not None:
+                self.start_sftp_session(conn, address)
+
+    def start_sftp_session(self, conn, address=None):
+        ip = address[0] if address else None
+        self.metrics.count('connections')
+        rejected = self.limits.admit(ip)
+        if rejected:
+            logging.info((u'Rejected connection from %s: %s' % (ip, rejected)).encode('utf-8'))
+            close_socket(conn)
+            return
+        interface = SSHInterface(self.get_user, self.limits, self.metrics)
+        try:
+            transport = SessionTransport(conn, on_close=lambda: self.limits.release(ip, interface.username))
+        except Exception as e:
+            # this runs on the accept loop, one bad connection mustn't stop it
+            logging.warning((u'Could not start a session for %s: %s' % (ip, e)).encode('utf-8'))
+            self.limits.release(ip)
+            close_socket(conn)
+            return
+        transport.banner_timeout = transport.handshake_timeout = transport.auth_timeout = self.login_timeout
+        for host_key in self.host_keys:
+            transport.add_server_key(host_key)
+        options = transport.get_security_options()
+        options.kex = self.kex
+        options.ciphers = self.ciphers
+        options.digests = self.macs
         transport.set_subsystem_handler(
-            'sftp', paramiko.SFTPServer, SFTPInterface, self.root)
+            'sftp', paramiko.SFTPServer, SFTPInterface,
+            self.root, self.on_write, self.listing_max, self.audit, self.quotas,
+            self.metrics)
+        with self.lock:
+            # the peer's address is kept, the socket can't tell it anymore once the peer reset it
+            self.logging_in[transport] = (time.monotonic() + self.login_timeout, address)
         # The SFTP session runs in a separate thread. We pass in `event`
         # so `start_server` doesn't block; we're not actually interested
         # in waiting for the event though.
-        transport.start_server(
-                server=SSHInterface(self.get_user),
-                event=threading.Event())
+        transport.start_server(server=interface, event=threading.Event())
+
+    def close_expired_logins(self):
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for transport, (deadline, address) in list(self.logging_in.items()):
+                if transport.is_authenticated() or not transport.is_active():
+                    del self.logging_in[transport]
+                elif now >= deadline:
+                    del self.logging_in[transport]
+                    expired.append((transport, address))
+        for transport, address in expired:
+            logging.info((u'Login timeout for %s' % (address,)).encode('utf-8'))
+            self.limits.count_rejection('login timeout')
+            transport.close()
+
+    def stats(self):
+        stats = self.limits.stats()
+        with self.lock:
+            stats['logging_in'] = len(self.logging_in)
+        return stats
 
     def get_user(self, username, password):
         raise NotImplementedError()
 
 
+class SessionTransport(paramiko.Transport):
+    """
+    A Transport that calls `on_close` once its thread is done, however the
+    session ended.
+    """
+
+    def __init__(self, sock, on_close=None):
+        super(SessionTransport, self).__init__(sock)
+        self.on_close = on_close
+
+    def run(self):
+        try:
+            super(SessionTransport, self).run()
+        finally:
+            if self.on_close:
+                self.on_close()
+
+
 class SSHInterface(paramiko.ServerInterface):
 
-    def __init__(self, get_user):
+    def __init__(self, get_user, limits=None, metrics=None):
         self.get_user = get_user
+        self.limits = limits
+        self.metrics = metrics
+        # set once the session counts against this user's limit
+        self.username = None
 
     def check_auth_password(self, username, password):
         user = self.get_user(username, password)
         if user:
+            rejected = self.limits.admit_user(username) if self.limits else None
+            if rejected:
+                logging.info((u'Auth rejected for %s: %s' % (username, rejected)).encode('utf-8'))
+                if self.metrics:
+                    self.metrics.count('login_rejected')
+                return paramiko.AUTH_FAILED
             logging.info((u'Auth successful for %s' % username).encode('utf-8'))
+            if self.metrics:
+                self.metrics.count('login_success')
+            self.username = username
             self.user = user
             return paramiko.AUTH_SUCCESSFUL
         else:
             logging.info((u'Auth failed for %s' % username).encode('utf-8'))
+            if self.metrics:
+                self.metrics.count('login_failure')
             return paramiko.AUTH_FAILED
 
     def check_channel_request(self, kind, chanid):
@@ -106,31 +261,49 @@ def sftp_response(fn):
 
 def log_event(method):
     """
-    Decorator which logs SFTP events along with the current user
+    Decorator which records SFTP events in the audit log along with the
+    current user, the paths involved, how they went and how long they took
     """
     @functools.wraps(method)
     def wrapper(self, *args, **kwargs):
-        string_args = u':'.join([arg for arg in args if isinstance(arg, str)])
-        msg = u'%s:%%s:%s:%s' % (method.__name__, self.user, string_args)
+        start = time.perf_counter()
+        result = 'ok'
         try:
-            response = method(self, *args, **kwargs)
-        except Exception:
-            logging.info((msg % 'error').encode('utf-8'))
+            return method(self, *args, **kwargs)
+        except Exception as e:
+            result = audit_result(e)
             raise
-        else:
-            logging.info((msg % 'ok').encode('utf-8'))
-        return response
+        finally:
+            self.audit.record(self.user, method.__name__, u':'.join([arg for arg in args if isinstance(arg, str)]),
+                              result, time.perf_counter() - start)
     return wrapper
 
 
+def audit_result(e):
+    """
+    Return how an operation that raised `e` went, for the audit log
+    """
+    if isinstance(e, PermissionDenied):
+        return 'denied'
+    if isinstance(e, OSError) and e.errno in errno.errorcode:
+        return errno.errorcode[e.errno]
+    return 'error'
+
+
 class SFTPInterface(paramiko.SFTPServerInterface):
 
     FILE_MODE = 0o664
     DIRECTORY_MODE = 0o775
 
-    def __init__(self, server, root):
+    def __init__(self, server, root, on_write=None, listing_max=None, audit=None, quotas=None,
+                 metrics=None):
         self.user = server.user
         self.root = root
+        self.on_write = on_write
+        self.listing_max = listing_max
+        self.audit = audit if audit is not None else AuditLog()
+        self.quotas = quotas
+        self.metrics = metrics
 
     def realpath_for_read(self, path):
         return self._realpath(path, self.user.has_read_access, False)
@@ -144,6 +317,21 @@ class SFTPInterface(paramiko.SFTPServerInterface):
             raise PermissionDenied()
         return os.path.join(self.root, path)
 
+    def _page(self, realpath):
+        # the page directory `realpath` is in, which quotas are kept for,
+        # None without quotas
+        if self.quotas is None:
+            return None
+        return self.user.pages.root_of(os.path.relpath(realpath, self.root))
+
+    def _check_quota(self, page, nbytes=0, nfiles=0):
+        if page is not None:
+            self.quotas.check(self.user.pages, page, nbytes, nfiles)
+
+    def _account(self, page, nbytes=0, nfiles=0):
+        if page is not None:
+            self.quotas.change(page, nbytes, nfiles)
+
     @sftp_response
     @log_event
     def open(self, path, flags, attr):
@@ -154,20 +342,48 @@ class SFTPInterface(paramiko.SFTPServerInterface):
             realpath = self.realpath_for_read(path)
         else:
             realpath = self.realpath_for_write(path)
-        fd = os.open(realpath, flags, self.FILE_MODE)
-        fileobj = os.fdopen(fd, flags_to_string(flags), self.FILE_MODE)
-        handle = SFTPFileHandle(flags)
-        handle.readfile = fileobj
+        page = old = None
         if not read_only:
-            handle.writefile = fileobj
+            page = self._page(realpath)
+            if page is not None:
+                old = lstat_or_none(realpath)
+                if old is None and flags & os.O_CREAT:
+                    self._check_quota(page, nfiles=1)
+        fd = os.open(realpath, flags, self.FILE_MODE)
+        accounted = False
+        try:
+            if page is not None:
+                # what the file had before it was truncated is accounted now,
+                # what it grows by when the handle is closed
+                self._account(page, -old.st_size if old is not None and flags & os.O_TRUNC else 0,
+                              1 if old is None else 0)
+            accounted = True
+            handle = SFTPFileHandle(flags, fd)
+            if page is not None:
+                handle.track_quota(self.quotas, self.user.pages, page)
+        except BaseException:
+            os.close(fd)
+            if not accounted and old is None and flags & os.O_CREAT:
+                # no quota counted the file this created
+                os.unlink(realpath)
+            raise
+        handle.audit = functools.partial(self.audit.record, self.user, 'close', path)
+        handle.metrics = self.metrics
+        if not read_only and self.on_write:
+            handle.on_close = functools.partial(self.on_write, realpath)
         return handle
 
     @sftp_response
     @log_event
     def list_folder(self, path):
         realpath = self.realpath_for_read(path)
-        return [sftp_attributes(os.path.join(realpath, filename))
-                    for filename in os.listdir(realpath)]
+        if self.listing_max is None:
+            return FolderListing(list_entries(realpath))
+        entries = list_entries(realpath, self.listing_max + 1)
+        if len(entries) > self.listing_max:
+            logging.info((u'Listing of %s cut off at %d entries' % (path, self.listing_max)).encode('utf-8'))
+            del entries[self.listing_max:]
+        return FolderListing(entries)
 
     @sftp_response
     @log_event
@@ -175,32 +391,73 @@ class SFTPInterface(paramiko.SFTPServerInterface):
         return sftp_attributes(self.realpath_for_read(path), follow_links=True)
 
     @sftp_response
+    @log_event
     def lstat(self, path):
         return sftp_attributes(self.realpath_for_read(path))
 
     @sftp_response
     @log_event
     def remove(self, path):
-        os.unlink(self.realpath_for_write(path))
+        realpath = self.realpath_for_write(path)
+        page = self._page(realpath)
+        old = lstat_or_none(realpath) if page is not None else None
+        os.unlink(realpath)
+        if old is not None:
+            self._account(page, -old.st_size, -1)
+        if self.on_write:
+            self.on_write(realpath)
 
     @sftp_response
     @log_event
     def rename(self, oldpath, newpath):
         old_real = self.realpath_for_write(oldpath, True)
         new_real = self.realpath_for_write(newpath, True)
-        os.rename(old_real, new_real)
+        old_page = self._page(old_real)
+        new_page = self._page(new_real)
+        if old_page is None and new_page is None:
+            os.rename(old_real, new_real)
+        else:
+            source = os.lstat(old_real)
+            # rename only replaces files and empty directories, a lstat tells what they take up
+            target = lstat_or_none(new_real)
+            if target is None:
+                replaced = (0, 0)
+            else:
+                replaced = (0 if S_ISDIR(target.st_mode) else target.st_size, 1)
+            if target is not None and os.path.samestat(source, target):
+                # both names are the same file (or hard links to it), rename leaves them as they are
+                os.rename(old_real, new_real)
+            elif old_page != new_page:
+                # only a move to another page has to know what's moved, which may be a whole tree
+                moved = self.quotas.usage_of(old_real)
+                self._check_quota(new_page, moved[0] - replaced[0], moved[1] - replaced[1])
+                os.rename(old_real, new_real)
+                self._account(old_page, -moved[0], -moved[1])
+                self._account(new_page, moved[0] - replaced[0], moved[1] - replaced[1])
+            else:
+                os.rename(old_real, new_real)
+                self._account(new_page, -replaced[0], -replaced[1])
+        if self.on_write:
+            self.on_write(old_real)
+            self.on_write(new_real)
 
     @sftp_response
     @log_event
     def mkdir(self, path, attr):
         # We ignore `attr` -- we choose the permissions around here,
         # not the client
-        os.mkdir(self.realpath_for_write(path), self.DIRECTORY_MODE)
+        realpath = self.realpath_for_write(path)
+        page = self._page(realpath)
+        self._check_quota(page, nfiles=1)
+        os.mkdir(realpath, self.DIRECTORY_MODE)
+        self._account(page, nfiles=1)
 
     @sftp_response
     @log_event
     def rmdir(self, path):
-        os.rmdir(self.realpath_for_write(path, True))
+        realpath = self.realpath_for_write(path, True)
+        os.rmdir(realpath)
+        self._account(self._page(realpath), nfiles=-1)
 
     @sftp_response
     @log_event
@@ -226,6 +483,92 @@ class SFTPInterface(paramiko.SFTPServerInterface):
 
 
 class SFTPFileHandle(paramiko.SFTPHandle):
+    """
+    A handle on the open file descriptor `fd`. Reads and writes go to the
+    offset the client asked for with `os.pread` and `os.pwrite`, without
+    seeking or buffering; in append mode writes go to the end of the file
+    regardless.
+
+    When it's closed, `on_close` is called, `audit` is called with the
+    result, how long closing took and the number of bytes read and written
+    through the handle, and those are added to `metrics`.
+
+    After `track_quota`, writes that grow the file reserve the bytes with
+    the `Quotas` first, and fail if that would go over a limit. On close,
+    the difference in size since then is accounted to the page.
+    """
+
+    on_close = None
+    audit = None
+    metrics = None
+    read_bytes = 0
+    written_bytes = 0
+    quotas = None
+
+    def __init__(self, flags, fd):
+        super(SFTPFileHandle, self).__init__(flags)
+        self.fd = fd
+        self.append = bool(flags & os.O_APPEND)
+
+    def track_quota(self, quotas, pages, page):
+        self.quotas = quotas
+        self.pages = pages
+        self.page = page
+        self.size = self.opened_size = os.fstat(self.fd).st_size
+        self.reserved = 0
+
+    def read(self, offset, length):
+        try:
+            data = os.pread(self.fd, length, offset)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        self.read_bytes += len(data)
+        return data
+
+    def write(self, offset, data):
+        if self.quotas is not None:
+            end = (self.size if self.append else offset) + len(data)
+            if end > self.size:
+                try:
+                    self.quotas.reserve(self.pages, self.page, end - self.size)
+                except OSError as e:
+                    return paramiko.SFTPServer.convert_errno(e.errno)
+                self.reserved += end - self.size
+                self.size = end
+        view = memoryview(data)
+        try:
+            while view:
+                written = os.pwrite(self.fd, view, offset)
+                view = view[written:]
+                offset += written
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        self.written_bytes += len(data)
+        return paramiko.SFTP_OK
+
+    def close(self):
+        start = time.perf_counter()
+        result = 'ok'
+        try:
+            if self.fd is not None:
+                fd, self.fd = self.fd, None
+                try:
+                    if self.quotas is not None:
+                        self.quotas.release(self.page, self.reserved)
+                        self.quotas.change(self.page, os.fstat(fd).st_size - self.opened_size)
+                finally:
+                    os.close(fd)
+            if self.on_close:
+                self.on_close()
+        except Exception as e:
+            result = audit_result(e)
+            raise
+        finally:
+            if self.audit:
+                self.audit(result, time.perf_counter() - start, self.read_bytes + self.written_bytes)
+            if self.metrics:
+                self.metrics.count('read_bytes', self.read_bytes)
+                self.metrics.count('written_bytes', self.written_bytes)
 
     @sftp_response
     def chattr(self, path, attr):
@@ -235,8 +578,7 @@ class SFTPFileHandle(paramiko.SFTPHandle):
 
     @sftp_response
     def stat(self):
-        return paramiko.SFTPAttributes.from_stat(
-                os.fstat(self.readfile.fileno()))
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.fd))
 
 
 def sftp_attributes(filepath, follow_links=False):
@@ -249,23 +591,109 @@ def sftp_attributes(filepath, follow_links=False):
         stat(filepath), filename=filename)
 
 
-def flags_to_string(flags):
+def lstat_or_none(path):
+    try:
+        return os.lstat(path)
+    except FileNotFoundError:
+        return None
+
+
+def check_algorithms(kind, names, default, supported):
     """
-    Convert bitmask of flags as taken by `os.open` into a mode string
-    as taken by `open`
+    Return `names` as a tuple, raising ValueError if paramiko doesn't
+    support one of them. If `names` is None, return the supported ones of
+    `default` instead.
     """
-    if flags & os.O_WRONLY:
-        if flags & os.O_APPEND:
-            mode = 'a'
-        else:
-            mode = 'w'
-    elif flags & os.O_RDWR:
-        if flags & os.O_APPEND:
-            mode = 'a+'
-        else:
-            mode = 'r+'
-    else:
-        mode = 'r'
-    # Force binary mode
-    mode += 'b'
-    return mode
+    if names is None:
+        names = [name for name in default if name in supported]
+    unsupported = [name for name in names if name not in supported]
+    if unsupported or not names:
+        raise ValueError('Unsupported %s algorithms: %s (supported: %s)' % (
+            kind, ', '.join(unsupported) or 'none given', ', '.join(supported)))
+    return tuple(names)
+
+
+def close_socket(conn):
+    try:
+        conn.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    conn.close()
+
+
+class FolderListing(list):
+    """
+    A directory listing that stats its entries as they're sent.
+
+    paramiko replies to READDIR with the listing 16 entries at a time, taking
+    them with `files[:16]` and keeping the rest with `files = files[16:]`.
+    Here the first builds SFTPAttributes for just those entries, and the
+    second is a view further into the same entries instead of a copy of the
+    rest of the list, so sending a listing is linear in its length and the
+    attributes for all of it are never held at once.
+
+    paramiko takes an empty batch for the end of the listing, so if every
+    entry of a batch was removed since the directory was read, `[:n]` takes
+    further entries until it has one and the following `[n:]` continues
+    after the last entry it took.
+    """
+
+    def __init__(self, entries, start=0):
+        super().__init__()
+        self.entries = entries
+        self.start = start
+        # (n, entries the last [:n] went through) when that was more than n
+        self.skipped = None
+
+    def __len__(self):
+        return len(self.entries) - self.start
+
+    def __iter__(self):
+        return iter(entry_attributes(self.entries[self.start:]))
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step is not None:
+            raise TypeError('FolderListing only supports slicing')
+        start, stop, _ = index.indices(len(self))
+        if index.stop is None:
+            if self.skipped is not None and start == self.skipped[0]:
+                start = self.skipped[1]
+            return FolderListing(self.entries, self.start + start)
+        attributes = entry_attributes(self.entries[self.start + start:self.start + stop])
+        end = self.start + stop
+        while not attributes and start < stop and end < len(self.entries):
+            attributes = entry_attributes(self.entries[end:end + stop - start])
+            end += stop - start
+        if start == 0 and end > self.start + stop:
+            self.skipped = (stop, min(end, len(self.entries)) - self.start)
+        return attributes
+
+
+def list_entries(dirpath, limit=None):
+    """
+    Return the `os.DirEntry`s of a directory, at most `limit` of them.
+    """
+    entries = []
+    with os.scandir(dirpath) as it:
+        for entry in it:
+            if limit is not None and len(entries) >= limit:
+                break
+            entries.append(entry)
+    return entries
+
+
+def entry_attributes(entries):
+    """
+    Return a list of SFTPAttributes for some `os.DirEntry`s. The entries
+    have the stat data on platforms whose directory listings include it and
+    lstat their path once otherwise.
+    """
+    attributes = []
+    for entry in entries:
+        try:
+            stat = entry.stat(follow_symlinks=False)
+        except FileNotFoundError:
+            # removed since the directory was read
+            continue
+        attributes.append(paramiko.SFTPAttributes.from_stat(stat, filename=entry.name))
+    return attributes
@@ -1,27 +1,76 @@
-import threading
+import hashlib
+import hmac
+import time
 from flask_app.models import User, DSPage
 
 class AuthenticationError(Exception): pass
 
 
+class CachedLogin(object):
+    __slots__ = ('user_id', 'password_digest', 'pages', 'stamp', 'expires')
+
+    def __init__(self, user_id, password_digest, pages, stamp, expires):
+        self.user_id = user_id
+        self.password_digest = password_digest
+        self.pages = pages
+        self.stamp = stamp
+        self.expires = expires
+
+
 class SQLiteAuth(object):
-    lock = threading.Lock()
+    """
+    Checks SFTP credentials against the users table, and returns the URIs of
+    the pages the user owns.
+
+    Successful logins are cached for `ttl` seconds (0 disables the cache), so
+    logging in again doesn't touch the database. Only a digest of the
+    password is kept, and passwords are compared in constant time. `stamps`
+    is an optional `OwnershipStamps`: a cached login is looked up again as
+    soon as the web app changes which pages the user owns.
+    """
 
-    def __init__(self, app, db):
+    def __init__(self, app, db, ttl=300, stamps=None):
         self.app = app
         self.db = db
+        self.ttl = ttl
+        self.stamps = stamps
+        # sftp username -> CachedLogin, only ever replaced as a whole so it can be read without a lock
+        self.cache = {}
 
     def __call__(self, *args, **kwargs):
         return self.authenticate(*args, **kwargs)
 
     def authenticate(self, username, password):
-        with self.lock:
-            return self.authenticate_thread_unsafe(username, password)
+        entry = self.cache.get(username)
+        if entry is not None and entry.expires > time.monotonic() and \
+                entry.stamp == self._stamp(entry.user_id) and \
+                hmac.compare_digest(entry.password_digest, _digest(password)):
+            return entry.pages
+        return self.authenticate_uncached(username, password)
 
-    def authenticate_thread_unsafe(self, username, password):
+    def authenticate_uncached(self, username, password):
         with self.app.app_context():
-            user = self.db.session.scalar(self.db.select(User).where(User.sftp_user == username and User.sftp_pass == password))
-            if not user:
+            user = self.db.session.scalar(self.db.select(User).where(User.sftp_user == username))
+            if not user or not hmac.compare_digest(user.sftp_pass.encode('utf-8'), password.encode('utf-8')):
                 raise AuthenticationError()
+            # read before the pages, so a change that lands in between bumps the stamp past this one
+            stamp = self._stamp(user.id)
             ds_pages = self.db.session.execute(self.db.select(DSPage).where(DSPage.user_id == user.id)).scalars().all()
-            return [page.get_uri() for page in ds_pages]
+            pages = tuple(page.get_uri() for page in ds_pages)
+        if self.ttl:
+            self.cache[username] = CachedLogin(user.id, _digest(password), pages, stamp, time.monotonic() + self.ttl)
+        return pages
+
+    def invalidate(self, username=None):
+        """Forgets the cached login of `username`, or all of them."""
+        if username is None:
+            self.cache = {}
+        else:
+            self.cache.pop(username, None)
+
+    def _stamp(self, user_id):
+        return self.stamps.get(user_id) if self.stamps else 0
+
+
+def _digest(password):
+    return hashlib.sha256(password.encode('utf-8')).digest()
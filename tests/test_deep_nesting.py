@@ -0,0 +1,38 @@
+"""
+Deeply nested STML pages parse and render with both engines without hitting the recursion limit.
+
+usage: python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app'))
+import stmlparse  # noqa: E402
+
+DEPTH = 10000
+
+
+def make_page(depth):
+    return ('<!doctype stml>\n<stml><head><title>deep</></><body>'
+            + '<block padding=1>' * depth + '<text>bottom</>' + '</>' * depth
+            + '</></>\n')
+
+
+class DeepNestingTest(unittest.TestCase):
+
+    def check_engine(self, engine):
+        html = stmlparse.stml_to_html('/browse', make_page(DEPTH), engine)
+        self.assertEqual(html.count('<div style="padding: 1px">'), DEPTH)
+        self.assertEqual(html.count('</div>'), DEPTH + 1)
+        self.assertTrue(html.endswith('</body></html>'))
+
+    def test_fast(self):
+        self.check_engine('fast')
+
+    def test_peg(self):
+        self.check_engine('peg')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+SFTP renames keep the storage quotas' usage right.
+
+usage: python -m unittest discover tests
+"""
+import collections
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import paramiko  # noqa: E402
+from sftp_server.sftp import SFTPInterface  # noqa: E402
+
+
+class Pages(object):
+    def root_of(self, path):
+        page = path.split('/', 1)[0]
+        return page if page.endswith('.zed') else None
+
+
+class User(object):
+    pages = Pages()
+
+    def has_write_access(self, path, block_root=False):
+        return True
+
+    def __str__(self):
+        return 'alice'
+
+
+class Quotas(object):
+    """Keeps usage in memory the way `Quotas.change` keeps it in the database."""
+
+    def __init__(self):
+        self.used = collections.defaultdict(lambda: [0, 0])
+
+    def check(self, pages, page, nbytes=0, nfiles=0):
+        pass
+
+    def change(self, page, nbytes=0, nfiles=0):
+        self.used[page][0] += nbytes
+        self.used[page][1] += nfiles
+
+    def usage_of(self, path):
+        nbytes, nfiles = os.lstat(path).st_size if not os.path.isdir(path) else 0, 1
+        for dirpath, dirnames, filenames in os.walk(path):
+            nfiles += len(dirnames) + len(filenames)
+            nbytes += sum(os.lstat(os.path.join(dirpath, name)).st_size for name in filenames)
+        return nbytes, nfiles
+
+
+class Server(object):
+    user = User()
+
+
+class QuotaRenameTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        for page in ('alice.zed', 'bob.zed'):
+            os.mkdir(os.path.join(self.root, page))
+        self.quotas = Quotas()
+        self.sftp = SFTPInterface(Server(), self.root, quotas=self.quotas)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, size):
+        with open(os.path.join(self.root, path), 'wb') as f:
+            f.write(b'x' * size)
+        self.quotas.change(path.split('/', 1)[0], size, 1)
+
+    def usage(self, page):
+        return tuple(self.quotas.used[page])
+
+    def test_rename_onto_itself(self):
+        self.write('alice.zed/a', 2500)
+        self.assertEqual(self.sftp.rename('/alice.zed/a', '/alice.zed/a'), paramiko.SFTP_OK)
+        self.assertEqual(self.usage('alice.zed'), (2500, 1))
+
+    def test_rename_onto_hard_link(self):
+        self.write('alice.zed/a', 2500)
+        os.link(os.path.join(self.root, 'alice.zed/a'), os.path.join(self.root, 'alice.zed/b'))
+        self.assertEqual(self.sftp.rename('/alice.zed/a', '/alice.zed/b'), paramiko.SFTP_OK)
+        self.assertEqual(self.usage('alice.zed'), (2500, 1))
+
+    def test_rename_replacing_file(self):
+        self.write('alice.zed/a', 2500)
+        self.write('alice.zed/b', 1000)
+        self.assertEqual(self.sftp.rename('/alice.zed/a', '/alice.zed/b'), paramiko.SFTP_OK)
+        self.assertEqual(self.usage('alice.zed'), (2500, 1))
+
+    def test_rename_to_other_page(self):
+        os.mkdir(os.path.join(self.root, 'alice.zed/d'))
+        self.quotas.change('alice.zed', 0, 1)
+        self.write('alice.zed/d/a', 2500)
+        self.assertEqual(self.sftp.rename('/alice.zed/d', '/bob.zed/d'), paramiko.SFTP_OK)
+        self.assertEqual(self.usage('alice.zed'), (0, 0))
+        self.assertEqual(self.usage('bob.zed'), (2500, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()